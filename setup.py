@@ -1,5 +1,4 @@
 import re
-import sys
 from os import path
 from setuptools import setup
 
@@ -31,14 +30,22 @@ setup(
     license='BSD',
     packages=[
         'simple_email_confirmation',
+        'simple_email_confirmation.management',
+        'simple_email_confirmation.management.commands',
         'simple_email_confirmation.migrations',
         'simple_email_confirmation.south_migrations',
         'simple_email_confirmation.tests',
         'simple_email_confirmation.tests.myproject',
         'simple_email_confirmation.tests.myproject.myapp',
     ],
+    package_data={
+        'simple_email_confirmation': [
+            'templates/simple_email_confirmation/*',
+        ],
+    },
+    python_requires='>=3.8',
     install_requires=[
-        'django>=1.7.0' if sys.version_info[0] > 2 else 'Django<2.0',
+        'django>=4.2',
         'six'
     ],
     classifiers=[
@@ -48,13 +55,17 @@ setup(
         'License :: OSI Approved :: BSD License',
         "Operating System :: OS Independent",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         'Topic :: Utilities',
         "Framework :: Django",
+        "Framework :: Django :: 4.2",
+        "Framework :: Django :: 5.0",
+        "Framework :: Django :: 5.1",
+        "Framework :: Django :: 5.2",
     ]
 )
@@ -3,20 +3,26 @@ __all__ = [
     'email_confirmed',
     'unconfirmed_email_created',
     'primary_email_changed',
+    'unconfirmed_emails_created',
+    'emails_confirmed',
+    'primary_emails_changed',
+    'operation_measured',
     'get_email_address_model',
 ]
 
 from django.conf import settings
-from django.apps import apps
+from django.apps import apps as django_apps
 
 from .signals import (
     email_confirmed, unconfirmed_email_created, primary_email_changed,
+    unconfirmed_emails_created, emails_confirmed, primary_emails_changed,
+    operation_measured,
 )
 
 
 def get_email_address_model():
     """Convenience method to return the email model being used."""
-    return apps.get_model(getattr(
+    return django_apps.get_model(getattr(
         settings,
         'SIMPLE_EMAIL_CONFIRMATION_EMAIL_ADDRESS_MODEL',
         'simple_email_confirmation.EmailAddress'
@@ -1,11 +1,159 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Upper
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 from simple_email_confirmation import get_email_address_model
+from . import cache as status_cache
+from . import mail
+from .models import get_key_mode
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the database's estimate of the number of rows in the
+    table, where it has one, when the list isn't filtered and the table has
+    more than estimate_above rows. Exact counts of large tables are slow.
+    """
+
+    estimate_above = 100000
+
+    @cached_property
+    def count(self):
+        estimate = self.get_estimate()
+        if estimate is not None and estimate > self.estimate_above:
+            return estimate
+        return super(EstimatedCountPaginator, self).count
+
+    def get_estimate(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where:
+            return None
+        table = queryset.model._meta.db_table
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [connection.ops.quote_name(table)],
+                )
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    'SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s',
+                    [table],
+                )
+            else:
+                return None
+            row = cursor.fetchone()
+        # PostgreSQL reports -1 for tables that were never analyzed
+        if row is None or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
+
+
+class ConfirmationStatusListFilter(admin.SimpleListFilter):
+    title = 'confirmation status'
+    parameter_name = 'status'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('confirmed', 'Confirmed'),
+            ('unconfirmed', 'Unconfirmed'),
+            ('expired', 'Expired'),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() == 'confirmed':
+            return queryset.confirmed()
+        if self.value() == 'unconfirmed':
+            return queryset.unconfirmed().unexpired()
+        if self.value() == 'expired':
+            return queryset.unconfirmed().expired()
+        return queryset
 
 
 class EmailAddressAdmin(admin.ModelAdmin):
     list_display = ('user', 'email', 'key', 'set_at', 'confirmed_at')
-    search_fields = ('email', 'key')
+    list_select_related = ('user',)
+    list_filter = (ConfirmationStatusListFilter,)
+    # searches are rewritten by get_search_results() into indexed lookups
+    search_fields = ('=email', '=key')
+    search_help_text = (
+        'An email address (any case) or a confirmation key. '
+        'End with * to search by the start of email addresses.'
+    )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('user',)
+    actions = ('resend_confirmation', 'confirm', 'purge_expired')
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.endswith('*'):
+            # case-sensitive, so that the email index can be used; on
+            # PostgreSQL it's built with varchar_pattern_ops for this
+            return queryset.filter(email__startswith=term[:-1]), False
+        manager = self.model._default_manager
+        queryset = queryset.alias(email_upper=Upper('email')).filter(
+            Q(email_upper=term.upper()) | Q(**manager._key_lookup(term))
+        )
+        return queryset, False
+
+    def delete_model(self, request, obj):
+        super(EmailAddressAdmin, self).delete_model(request, obj)
+        self.model._default_manager.revoke_signed_keys(
+            [(obj.user_id, obj.email)],
+        )
+
+    def delete_queryset(self, request, queryset):
+        pairs = list(queryset.values_list('user_id', 'email'))
+        super(EmailAddressAdmin, self).delete_queryset(request, queryset)
+        self.model._default_manager.revoke_signed_keys(pairs)
+
+    @admin.action(description='Resend confirmation of selected addresses')
+    def resend_confirmation(self, request, queryset):
+        manager = self.model._default_manager
+        addresses = list(queryset.unconfirmed().select_related('user'))
+        now = timezone.now()
+        keys = manager.generate_unused_keys(len(addresses))
+        signed = get_key_mode() == 'signed'
+        for address, key in zip(addresses, keys):
+            address.raw_key = key
+            address.key = manager.get_stored_key(key)
+            address.set_at = now
+            if signed:
+                address.raw_key = manager.make_signed_key(
+                    address.user_id, address.email, now,
+                )
+        manager.bulk_update(addresses, ['key', 'set_at'])
+        status_cache.invalidate(address.user_id for address in addresses)
+        sent = mail.send_confirmation_emails(addresses)
+        self.message_user(
+            request, 'Sent {} confirmation emails.'.format(sent),
+        )
+
+    @admin.action(description='Confirm selected addresses')
+    def confirm(self, request, queryset):
+        addresses = self.model._default_manager.bulk_confirm(queryset)
+        self.message_user(
+            request, 'Confirmed {} addresses.'.format(len(addresses)),
+        )
+
+    @admin.action(description='Delete selected expired, unconfirmed addresses')
+    def purge_expired(self, request, queryset):
+        queryset = queryset.unconfirmed().expired().not_primary()
+        user_pks = list(queryset.values_list('user_id', flat=True))
+        deleted, _ = queryset.delete()
+        status_cache.invalidate(user_pks)
+        self.message_user(
+            request, 'Deleted {} expired addresses.'.format(deleted),
+        )
 
 
 admin.site.register(get_email_address_model(), EmailAddressAdmin)
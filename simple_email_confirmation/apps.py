@@ -0,0 +1,41 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_save
+
+
+class SimpleEmailConfirmationConfig(AppConfig):
+    name = 'simple_email_confirmation'
+    verbose_name = 'Simple Email Confirmation'
+    # the primary keys the migrations were written with
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from . import mail
+        from .cache import track_changes
+        from .models import auto_add
+        from .signals import unconfirmed_email_created, unconfirmed_emails_created
+
+        # by default, auto-add unconfirmed EmailAddress objects for new Users
+        if getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_AUTO_ADD', True):
+            post_save.connect(
+                auto_add, sender=settings.AUTH_USER_MODEL,
+                dispatch_uid='simple_email_confirmation.auto_add',
+            )
+
+        # with the shared cache on, cached addresses are forgotten whenever
+        # an address is saved or deleted, including by the admin and by
+        # deleting its User
+        track_changes()
+
+        # by default, sending confirmation emails is left to you. If you want
+        # them sent whenever unconfirmed addresses are created, set
+        # settings.SIMPLE_EMAIL_CONFIRMATION_SEND_EMAILS to True.
+        if getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_SEND_EMAILS', False):
+            unconfirmed_email_created.connect(
+                mail.send_on_unconfirmed_email_created,
+                dispatch_uid='simple_email_confirmation.send_email',
+            )
+            unconfirmed_emails_created.connect(
+                mail.send_on_unconfirmed_emails_created,
+                dispatch_uid='simple_email_confirmation.send_emails',
+            )
@@ -0,0 +1,220 @@
+"""
+Simple Email Confirmation benchmarks
+
+run_benchmarks() seeds Users and email addresses, times the confirmation
+lifecycle operations on them and counts their queries, then rolls everything
+back. benchmark_keys() times key generation, and key_collision_report() gives
+the odds of keys colliding at the configured length. The
+benchmark_email_confirmation management command prints their results as
+JSON, to be compared between releases.
+"""
+import math
+import platform
+import time
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import CaptureQueriesContext
+
+import simple_email_confirmation
+from simple_email_confirmation import get_email_address_model
+from . import cache as status_cache, dispatch
+from .models import KEY_ALPHABET, get_key_length, get_key_mode
+
+OPERATIONS = (
+    'add_unconfirmed_email', 'confirm_email', 'add_email_if_not_exists',
+    'set_primary_email', 'is_confirmed', 'get_confirmed_emails',
+)
+
+EMAIL_DOMAIN = 'benchmark.invalid'
+
+# numbers of stored keys the collision odds are reported for
+KEY_TABLE_SIZES = (10 ** 6, 10 ** 7, 10 ** 8)
+
+
+def _percentile(durations, fraction):
+    index = min(len(durations) - 1, int(len(durations) * fraction))
+    return durations[index]
+
+
+def _measure(connection, users, operation):
+    durations = []
+    with CaptureQueriesContext(connection) as queries:
+        for user in users:
+            start = time.perf_counter()
+            operation(user)
+            durations.append(time.perf_counter() - start)
+    if not durations:
+        return {'iterations': 0}
+    total = sum(durations)
+    durations.sort()
+    return {
+        'iterations': len(durations),
+        'ops_per_sec': round(len(durations) / total, 1) if total else None,
+        'mean_us': round(total / len(durations) * 1e6, 1),
+        'p50_us': round(_percentile(durations, 0.5) * 1e6, 1),
+        'p95_us': round(_percentile(durations, 0.95) * 1e6, 1),
+        'queries_per_op': round(len(queries) / float(len(durations)), 2),
+    }
+
+
+def _seed(users, addresses, using):
+    user_model = get_user_model()
+    field_name = getattr(user_model, 'primary_email_field_name', 'email')
+    usernames = ['benchmark-{}'.format(i) for i in range(users)]
+    seeded = user_model._default_manager.db_manager(using).bulk_create([
+        user_model(**{
+            user_model.USERNAME_FIELD: username,
+            field_name: '{}@{}'.format(username, EMAIL_DOMAIN),
+        })
+        for username in usernames
+    ])
+    if seeded and seeded[0].pk is None:
+        # backends that can't return primary keys from bulk inserts
+        seeded = list(user_model._default_manager.db_manager(using).filter(**{
+            '{}__in'.format(user_model.USERNAME_FIELD): usernames,
+        }))
+
+    pairs = []
+    for user in seeded:
+        pairs.append((user, getattr(user, field_name)))
+        for i in range(addresses):
+            pairs.append((user, 'benchmark-{}-{}@{}'.format(
+                user.pk, i, EMAIL_DOMAIN,
+            )))
+    manager = get_email_address_model()._default_manager.db_manager(using)
+    manager.bulk_create_confirmed(pairs)
+    return seeded
+
+
+def _benchmark(users, connection):
+    keys = {}
+
+    def add_unconfirmed_email(user):
+        email = 'new-{}@{}'.format(user.pk, EMAIL_DOMAIN)
+        keys[user.pk] = (email, user.add_unconfirmed_email(email))
+
+    def confirm_email(user):
+        user.confirm_email(keys[user.pk][1])
+
+    def add_email_if_not_exists(user):
+        user.add_email_if_not_exists(keys[user.pk][0])
+
+    def set_primary_email(user):
+        user.set_primary_email(keys[user.pk][0])
+
+    def is_confirmed(user):
+        # a fresh read each time, as on a new request
+        user.clear_email_address_cache()
+        user.is_confirmed
+
+    def get_confirmed_emails(user):
+        user.clear_email_address_cache()
+        user.get_confirmed_emails()
+
+    operations = {
+        'add_unconfirmed_email': add_unconfirmed_email,
+        'confirm_email': confirm_email,
+        'add_email_if_not_exists': add_email_if_not_exists,
+        'set_primary_email': set_primary_email,
+        'is_confirmed': is_confirmed,
+        'get_confirmed_emails': get_confirmed_emails,
+    }
+    return dict(
+        (name, _measure(connection, users, operations[name]))
+        for name in OPERATIONS
+    )
+
+
+def benchmark_keys(count=100000):
+    """
+    Time generating count keys one at a time and all at once, as the
+    bulk creation methods do. Returns keys per second for each.
+    """
+    manager = get_email_address_model()._default_manager
+    start = time.perf_counter()
+    for _ in range(count):
+        manager.generate_key()
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    manager.generate_keys(count)
+    batched = time.perf_counter() - start
+    return {
+        'keys': count,
+        'single_keys_per_sec': round(count / single) if single else None,
+        'batched_keys_per_sec': round(count / batched) if batched else None,
+    }
+
+
+def key_collision_report(length=None, table_sizes=KEY_TABLE_SIZES):
+    """
+    Odds of keys of length characters colliding, by default at the
+    configured length: for each number of stored keys, the probability that
+    a new key collides with one of them, and that any two of them collided
+    when they were generated. Collisions are retried, so these are the odds
+    of paying for a retry, not of a failure.
+    """
+    length = length or get_key_length()
+    keyspace = len(KEY_ALPHABET) ** length
+    report = {'length': length, 'keyspace': keyspace, 'stored_keys': {}}
+    for size in table_sizes:
+        report['stored_keys'][str(size)] = {
+            'new_key': size / float(keyspace),
+            # the birthday bound, precise for tiny probabilities
+            'any_pair': -math.expm1(-size * (size - 1) / (2.0 * keyspace)),
+        }
+    return report
+
+
+def run_benchmarks(users=1000, addresses=2, iterations=None, using=None,
+                   keys=100000):
+    """
+    Seed users Users with addresses confirmed email addresses each besides
+    their primary one, then time each of OPERATIONS on iterations of them.
+    Nothing is left in the database, no signals reach receivers and the
+    shared cache isn't used. Generation of keys keys is timed too.
+    Returns the results as a dict.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    connection = connections[using]
+    user_model = get_user_model()
+    if not hasattr(user_model, 'add_unconfirmed_email'):
+        raise ImproperlyConfigured(
+            'The User model needs SimpleEmailConfirmationUserMixin'
+        )
+
+    results = {}
+    # the seeded Users mustn't be seen outside the rolled back transaction,
+    # so receivers, and with them confirmation emails, never hear of them,
+    # and they're neither cached nor counted against resend rate limits
+    with dispatch.muted(), status_cache.bypassed():
+        with transaction.atomic(using=using):
+            seed_start = time.perf_counter()
+            seeded = _seed(users, addresses, using)
+            results['seed_seconds'] = round(
+                time.perf_counter() - seed_start, 3,
+            )
+            results['operations'] = _benchmark(
+                seeded[:iterations], connection,
+            )
+            transaction.set_rollback(True, using=using)
+    results['keys'] = benchmark_keys(keys)
+    results['key_collisions'] = key_collision_report()
+
+    results['environment'] = {
+        'package_version': simple_email_confirmation.__version__,
+        'django_version': django.get_version(),
+        'python_version': platform.python_version(),
+        'database_vendor': connection.vendor,
+        'database_version': '.'.join(
+            str(part) for part in getattr(
+                connection, 'get_database_version', lambda: ()
+            )()
+        ) or None,
+        'key_mode': get_key_mode(),
+        'users': users,
+        'addresses_per_user': addresses + 1,
+    }
+    return results
@@ -0,0 +1,260 @@
+"""
+Simple Email Confirmation caches of Users' email addresses
+
+The shared cache is off by default. To serve SimpleEmailConfirmationUserMixin's
+status lookups from one of your CACHES, set
+settings.SIMPLE_EMAIL_CONFIRMATION_CACHE to its alias. Hits and misses are
+counted in simple_email_confirmation.metrics as 'cache.hits' and
+'cache.misses'.
+
+Addresses read inside a transaction aren't cached, as it may be rolled back.
+
+The request memo is active while EmailConfirmationStatusMiddleware handles a
+request. It's checked before the shared cache, so every instance of a User
+loaded during the request shares one read of its addresses.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import metrics
+
+_request_memo = ContextVar('simple_email_confirmation_request_memo', default=None)
+
+_bypassed = ContextVar(
+    'simple_email_confirmation_cache_bypassed', default=False,
+)
+
+# whether invalidate_on_change() is connected
+_tracking = False
+
+
+def get_cache():
+    "The cache in use, or None"
+    alias = getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_CACHE', None)
+    return caches[alias] if alias and not _bypassed.get() else None
+
+
+@contextmanager
+def bypassed():
+    """
+    Leave the shared cache and resend rate limit counts alone inside the
+    block, e.g. while benchmarking
+    """
+    token = _bypassed.set(True)
+    try:
+        yield
+    finally:
+        _bypassed.reset(token)
+
+
+def is_bypassed():
+    return _bypassed.get()
+
+
+def get_timeout():
+    # By default, entries are kept for 5 minutes. If you want to change it,
+    # set settings.SIMPLE_EMAIL_CONFIRMATION_CACHE_TIMEOUT to a number of
+    # seconds.
+    return getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_CACHE_TIMEOUT', 300)
+
+
+def make_key(user_pk):
+    # By default, keys are prefixed with 'simple_email_confirmation'. If you
+    # want to change it, set settings.SIMPLE_EMAIL_CONFIRMATION_CACHE_KEY_PREFIX.
+    prefix = getattr(
+        settings, 'SIMPLE_EMAIL_CONFIRMATION_CACHE_KEY_PREFIX',
+        'simple_email_confirmation',
+    )
+    return '{}:addresses:{}'.format(prefix, user_pk)
+
+
+def _dump(addresses):
+    return [
+        [getattr(address, field.attname) for field in address._meta.concrete_fields]
+        for address in addresses
+    ]
+
+
+def _load(user, rows):
+    model = user.email_address_set.model
+    attnames = [field.attname for field in model._meta.concrete_fields]
+    addresses = []
+    for values in rows:
+        address = model.from_db(None, attnames, values)
+        address.user = user
+        addresses.append(address)
+    return addresses
+
+
+def start_request_memo():
+    "Start memoizing addresses for the rest of the current request"
+    _request_memo.set({})
+
+
+def end_request_memo():
+    "Stop memoizing addresses and forget the ones memoized"
+    _request_memo.set(None)
+
+
+def _count(rows):
+    metrics.incr('cache.misses' if rows is None else 'cache.hits')
+
+
+def _get_memoized(user):
+    memo = _request_memo.get()
+    if memo is None:
+        return None
+    rows = memo.get(user.pk)
+    return None if rows is None else _load(user, rows)
+
+
+def _memoize(user, rows):
+    memo = _request_memo.get()
+    if memo is not None:
+        memo[user.pk] = rows
+
+
+def get_addresses(user):
+    "The User's memoized or cached email addresses, or None"
+    addresses = _get_memoized(user)
+    if addresses is not None or get_cache() is None:
+        return addresses
+    rows = get_cache().get(make_key(user.pk))
+    _count(rows)
+    if rows is None:
+        return None
+    _memoize(user, rows)
+    return _load(user, rows)
+
+
+def set_addresses(user, addresses):
+    """
+    Memoize and cache the User's email addresses. Inside a transaction
+    they're only memoized, as it may yet be rolled back.
+    """
+    rows = _dump(addresses)
+    _memoize(user, rows)
+    using = user._state.db or DEFAULT_DB_ALIAS
+    if get_cache() is not None and not connections[using].in_atomic_block:
+        get_cache().set(make_key(user.pk), rows, get_timeout())
+
+
+async def aget_addresses(user):
+    "Async version of get_addresses()"
+    addresses = _get_memoized(user)
+    if addresses is not None or get_cache() is None:
+        return addresses
+    rows = await get_cache().aget(make_key(user.pk))
+    _count(rows)
+    if rows is None:
+        return None
+    _memoize(user, rows)
+    return _load(user, rows)
+
+
+async def aset_addresses(user, addresses):
+    "Async version of set_addresses(), for use outside transactions"
+    rows = _dump(addresses)
+    _memoize(user, rows)
+    if get_cache() is not None:
+        await get_cache().aset(make_key(user.pk), rows, get_timeout())
+
+
+def forget_memoized(user_pks):
+    "Forget the memoized email addresses of these Users"
+    memo = _request_memo.get()
+    if memo is not None:
+        for pk in user_pks:
+            memo.pop(pk, None)
+
+
+def invalidate(user_pks, using=None):
+    """
+    Forget the memoized and cached email addresses of the Users with the given
+    primary keys. Inside a transaction, they're forgotten from the cache again
+    once it commits, so that a concurrent read can't cache the addresses as
+    they were before.
+    """
+    user_pks = set(user_pks)
+    forget_memoized(user_pks)
+    cache = get_cache()
+    if cache is None:
+        return
+    keys = [make_key(pk) for pk in user_pks]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    using = using or DEFAULT_DB_ALIAS
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+async def ainvalidate(user_pks, using=None):
+    "Async version of invalidate()"
+    user_pks = set(user_pks)
+    forget_memoized(user_pks)
+    cache = get_cache()
+    keys = [make_key(pk) for pk in user_pks]
+    if cache is not None and keys:
+        await cache.adelete_many(keys)
+
+
+def invalidate_saved(user_pks, using=None):
+    """
+    invalidate(), after saving or deleting single addresses, unless
+    invalidate_on_change() has already done it
+    """
+    if not _tracking:
+        invalidate(user_pks, using=using)
+
+
+async def ainvalidate_saved(user_pks):
+    "Async version of invalidate_saved()"
+    if not _tracking:
+        await ainvalidate(user_pks)
+
+
+def invalidate_on_change(sender, instance, using=None, **kwargs):
+    """
+    Forget the cached email addresses of the saved or deleted address's User.
+    Connected to post_save and post_delete of the email address model while
+    the shared cache is on, so that saves from the admin and deletes
+    cascading from Users are seen too.
+    """
+    if not kwargs.get('raw'):
+        invalidate([instance.user_id], using=using)
+
+
+def track_changes():
+    """
+    Connect invalidate_on_change() if the shared cache is on, or disconnect
+    it. A post_delete receiver keeps Django from deleting rows without
+    reading them first, so it's only connected when needed.
+    """
+    global _tracking
+    from . import get_email_address_model
+    model = get_email_address_model()
+    _tracking = get_cache() is not None
+    for signal, dispatch_uid in (
+        (post_save, 'simple_email_confirmation.invalidate_on_save'),
+        (post_delete, 'simple_email_confirmation.invalidate_on_delete'),
+    ):
+        if _tracking:
+            signal.connect(
+                invalidate_on_change, sender=model, dispatch_uid=dispatch_uid,
+            )
+        else:
+            signal.disconnect(sender=model, dispatch_uid=dispatch_uid)
+
+
+@receiver(setting_changed)
+def _track_changes(setting, **kwargs):
+    if setting == 'SIMPLE_EMAIL_CONFIRMATION_CACHE':
+        track_changes()
@@ -0,0 +1,216 @@
+"""
+Simple Email Confirmation signal delivery
+
+By default, the app's signals are sent synchronously, from within the call
+that caused them. If you want slow receivers kept off the request, set
+settings.SIMPLE_EMAIL_CONFIRMATION_SIGNAL_DISPATCH to 'deferred'. Signals are
+then handed to a queue once the surrounding transaction commits, so receivers
+never see uncommitted rows, and sent from the queue's worker.
+
+The default queue, ThreadPoolSignalQueue, delivers from a background thread.
+Signals put while its worker is busy are coalesced and delivered together as
+one batch. To deliver from your own workers instead, subclass BaseSignalQueue,
+set settings.SIMPLE_EMAIL_CONFIRMATION_SIGNAL_QUEUE to its dotted path and
+have your workers call deliver().
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.module_loading import import_string
+
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+_muted = ContextVar('simple_email_confirmation_signals_muted', default=False)
+
+DISPATCH_MODES = ('sync', 'deferred')
+
+# signals are queued by name, so that external queues can serialize them
+SIGNALS = {
+    'email_confirmed': signals.email_confirmed,
+    'unconfirmed_email_created': signals.unconfirmed_email_created,
+    'primary_email_changed': signals.primary_email_changed,
+    'unconfirmed_emails_created': signals.unconfirmed_emails_created,
+    'emails_confirmed': signals.emails_confirmed,
+    'primary_emails_changed': signals.primary_emails_changed,
+}
+
+
+def get_dispatch_mode():
+    mode = getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_SIGNAL_DISPATCH', 'sync')
+    if mode not in DISPATCH_MODES:
+        raise ImproperlyConfigured(
+            'SIMPLE_EMAIL_CONFIRMATION_SIGNAL_DISPATCH must be one of {}'.format(
+                ', '.join(DISPATCH_MODES),
+            )
+        )
+    return mode
+
+
+def deliver(batch):
+    """
+    Send a batch of queued signals, in order, as a list of (name, kwargs)
+    pairs. A receiver that raises is logged and doesn't stop the others.
+    """
+    for name, kwargs in batch:
+        responses = SIGNALS[name].send_robust(**kwargs)
+        for receiver, response in responses:
+            if isinstance(response, Exception):
+                logger.error(
+                    'Error delivering %s to %r', name, receiver,
+                    exc_info=(type(response), response, response.__traceback__),
+                )
+
+
+class BaseSignalQueue(object):
+    "Interface for the queues deferred signals are handed to"
+
+    def put(self, name, kwargs):
+        "Arrange for deliver([(name, kwargs)]) to be called, soon"
+        raise NotImplementedError
+
+    def join(self):
+        "Wait until everything put so far has been delivered"
+
+
+class ThreadPoolSignalQueue(BaseSignalQueue):
+    """
+    Deliver signals from a background thread. One worker is used by default,
+    so that signals are delivered in the order they were sent. If you want
+    more, set settings.SIMPLE_EMAIL_CONFIRMATION_SIGNAL_WORKERS.
+    """
+
+    def __init__(self):
+        self.max_workers = getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_SIGNAL_WORKERS', 1,
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='simple_email_confirmation',
+        )
+        self.condition = threading.Condition()
+        self.pending = []
+        self.active = 0
+
+    def put(self, name, kwargs):
+        with self.condition:
+            self.pending.append((name, kwargs))
+            # a busy worker picks this one up with the rest of its next batch
+            if self.active >= self.max_workers:
+                return
+            self.active += 1
+        self.executor.submit(self.run)
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    batch, self.pending = self.pending, []
+                    if not batch:
+                        self.active -= 1
+                        self.condition.notify_all()
+                        return
+                deliver(batch)
+        finally:
+            # receivers may have used the database from this thread
+            connections.close_all()
+
+    def join(self):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: not self.pending and not self.active,
+            )
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    "The queue deferred signals are handed to"
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            path = getattr(
+                settings, 'SIMPLE_EMAIL_CONFIRMATION_SIGNAL_QUEUE',
+                'simple_email_confirmation.dispatch.ThreadPoolSignalQueue',
+            )
+            _queue = import_string(path)()
+        return _queue
+
+
+@contextmanager
+def muted():
+    "Drop the app's signals sent inside the block, e.g. while benchmarking"
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def send(signal, using=None, **kwargs):
+    """
+    Send one of the app's signals, now or, in deferred mode, once the
+    transaction on the using database commits.
+    """
+    if get_dispatch_mode() == 'sync':
+        if not _muted.get():
+            signal.send(**kwargs)
+        return
+    if _muted.get():
+        return
+    name = _get_name(signal)
+    transaction.on_commit(
+        lambda: get_queue().put(name, kwargs), using=using or DEFAULT_DB_ALIAS,
+    )
+
+
+async def asend(signal, **kwargs):
+    "Async version of send()"
+    if _muted.get():
+        return
+    if get_dispatch_mode() == 'sync':
+        # Signal.asend() runs async receivers on the event loop
+        if hasattr(signal, 'asend'):
+            await signal.asend(**kwargs)
+        else:
+            await _asend_compat(signal, **kwargs)
+        return
+    # async code runs outside transactions, so the rows are committed
+    get_queue().put(_get_name(signal), kwargs)
+
+
+async def _asend_compat(signal, sender, **kwargs):
+    # Django 4.2 has no Signal.asend(), and its send() calls async receivers
+    # without awaiting them: sync receivers are called from one thread, as
+    # asend() does, and async ones awaited here
+    receivers = signal._live_receivers(sender)
+    sync_receivers = [
+        receiver for receiver in receivers
+        if not iscoroutinefunction(receiver)
+    ]
+    if sync_receivers:
+        def send():
+            for receiver in sync_receivers:
+                receiver(signal=signal, sender=sender, **kwargs)
+        await sync_to_async(send)()
+    for receiver in receivers:
+        if iscoroutinefunction(receiver):
+            await receiver(signal=signal, sender=sender, **kwargs)
+
+
+def _get_name(signal):
+    for name, candidate in SIGNALS.items():
+        if candidate is signal:
+            return name
+    raise ValueError('{!r} is not one of the app\'s signals'.format(signal))
@@ -15,3 +15,11 @@ class EmailConfirmationExpired(SimpleEmailConfirmationException):
 
 class EmailIsPrimary(SimpleEmailConfirmationException):
     pass
+
+
+class EmailConfirmationKeyNotStored(SimpleEmailConfirmationException):
+    pass
+
+
+class EmailConfirmationThrottled(SimpleEmailConfirmationException):
+    pass
@@ -0,0 +1,123 @@
+"""
+Simple Email Confirmation export of email addresses
+
+Rows are streamed from the database a chunk at a time and written as they
+arrive, so memory use doesn't grow with the size of the table.
+"""
+import csv
+import json
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from simple_email_confirmation import get_email_address_model
+
+FIELDS = (
+    'id', 'user_id', 'username', 'email', 'primary', 'confirmed', 'expired',
+    'set_at', 'confirmed_at',
+)
+STATUSES = ('confirmed', 'unconfirmed', 'expired')
+FORMATS = ('csv', 'jsonl')
+
+
+def filter_addresses(queryset, status=None, set_after=None, set_before=None):
+    """
+    Narrow a queryset of email addresses down to those with the given status,
+    one of STATUSES, and set_at in the given range
+    """
+    if status == 'confirmed':
+        queryset = queryset.confirmed()
+    elif status == 'unconfirmed':
+        queryset = queryset.unconfirmed().unexpired()
+    elif status == 'expired':
+        queryset = queryset.unconfirmed().expired()
+    elif status is not None:
+        raise ValueError('status must be one of {}'.format(', '.join(STATUSES)))
+    if set_after is not None:
+        queryset = queryset.filter(set_at__gte=set_after)
+    if set_before is not None:
+        queryset = queryset.filter(set_at__lt=set_before)
+    return queryset
+
+
+def iter_rows(queryset=None, chunk_size=2000, **filters):
+    """
+    Yield a dict of FIELDS for each email address, in primary key order,
+    reading chunk_size addresses per query. Takes the same filters as
+    filter_addresses().
+    """
+    if queryset is None:
+        queryset = get_email_address_model()._default_manager.all()
+    queryset = filter_addresses(queryset, **filters)
+
+    user_model = get_user_model()
+    username_field = user_model.USERNAME_FIELD
+    primary_email_field = getattr(user_model, 'primary_email_field_name', 'email')
+    queryset = queryset.select_related('user').only(
+        'pk', 'user_id', 'email', 'set_at', 'confirmed_at',
+        'user__{}'.format(username_field),
+        'user__{}'.format(primary_email_field),
+    ).order_by('pk')
+
+    now = timezone.now()
+    for address in queryset.iterator(chunk_size=chunk_size):
+        user = address.user
+        expires_at = address.key_expires_at
+        yield {
+            'id': address.pk,
+            'user_id': address.user_id,
+            'username': getattr(user, username_field),
+            'email': address.email,
+            'primary': getattr(user, primary_email_field) == address.email,
+            'confirmed': address.is_confirmed,
+            'expired': bool(
+                not address.is_confirmed and expires_at and expires_at <= now
+            ),
+            'set_at': address.set_at,
+            'confirmed_at': address.confirmed_at,
+        }
+
+
+def _serialize(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def write_csv(rows, file):
+    "Write rows to file as CSV, with a header. Returns the number of rows."
+    writer = csv.writer(file)
+    writer.writerow(FIELDS)
+    count = 0
+    for row in rows:
+        writer.writerow([
+            '' if row[field] is None else _serialize(row[field])
+            for field in FIELDS
+        ])
+        count += 1
+    return count
+
+
+def write_jsonl(rows, file):
+    "Write rows to file as JSON Lines. Returns the number of rows."
+    count = 0
+    for row in rows:
+        file.write(json.dumps(dict(
+            (field, _serialize(row[field])) for field in FIELDS
+        )) + '\n')
+        count += 1
+    return count
+
+
+def export_addresses(file, format='csv', queryset=None, chunk_size=2000,
+                     **filters):
+    """
+    Write email addresses to file, as 'csv' or 'jsonl'. Takes the same
+    filters as filter_addresses(). Returns the number of addresses written.
+    """
+    if format not in FORMATS:
+        raise ValueError('format must be one of {}'.format(', '.join(FORMATS)))
+    rows = iter_rows(queryset=queryset, chunk_size=chunk_size, **filters)
+    if format == 'csv':
+        return write_csv(rows, file)
+    return write_jsonl(rows, file)
@@ -0,0 +1,177 @@
+"""
+Simple Email Confirmation instrumentation
+
+Off by default. If you want to know how long the app's operations take, how
+many queries they make and how they turn out, set
+settings.SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION to a list of sinks, as
+dotted paths to callables. Each is called with a Measurement after every
+instrumented operation; a sink that raises is logged. log_measurement() and
+send_measurement_signal() are provided; to feed statsd or similar, point to
+a function of your own.
+
+Operations are named after the method, e.g. 'user.confirm_email' or
+'manager.confirm'. Operations that call others are measured at each level.
+Queries aren't counted for async operations, which make theirs in another
+thread.
+"""
+import logging
+from collections import namedtuple
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .exceptions import (
+    EmailConfirmationExpired, EmailConfirmationThrottled, EmailIsPrimary,
+    EmailNotConfirmed,
+)
+from .signals import operation_measured
+
+logger = logging.getLogger(__name__)
+
+Measurement = namedtuple(
+    'Measurement', ['operation', 'duration', 'queries', 'outcome'],
+)
+
+# outcomes of operations that raised, most specific first
+EXCEPTION_OUTCOMES = (
+    (EmailConfirmationExpired, 'expired'),
+    (ObjectDoesNotExist, 'not_found'),
+    (EmailConfirmationThrottled, 'throttled'),
+    (EmailNotConfirmed, 'not_confirmed'),
+    (EmailIsPrimary, 'is_primary'),
+    (IntegrityError, 'integrity_error'),
+)
+
+_sinks = None
+
+
+def get_sinks():
+    "The sinks measurements are sent to, or an empty list when disabled"
+    global _sinks
+    # loaded once, as reading an unset setting costs microseconds per call
+    if _sinks is None:
+        paths = getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION', None,
+        ) or []
+        _sinks = [
+            import_string(path) if isinstance(path, str) else path
+            for path in paths
+        ]
+    return _sinks
+
+
+@receiver(setting_changed)
+def _reset_sinks(setting, **kwargs):
+    global _sinks
+    if setting == 'SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION':
+        _sinks = None
+
+
+def log_measurement(measurement):
+    "Sink logging each measurement at DEBUG level"
+    logger.debug(
+        '%s: %s in %.2fms, %s queries', measurement.operation,
+        measurement.outcome, measurement.duration * 1000, measurement.queries,
+    )
+
+
+def send_measurement_signal(measurement):
+    "Sink sending the operation_measured signal for each measurement"
+    operation_measured.send(sender=Measurement, measurement=measurement)
+
+
+def _record(sinks, operation, start, queries, outcome):
+    measurement = Measurement(
+        operation, perf_counter() - start, queries, outcome,
+    )
+    # a failing sink mustn't fail the operation, which may have written already
+    for sink in sinks:
+        try:
+            sink(measurement)
+        except Exception:
+            logger.exception('Error sending %s to %r', operation, sink)
+
+
+def _exception_outcome(exception):
+    for exception_class, outcome in EXCEPTION_OUTCOMES:
+        if isinstance(exception, exception_class):
+            return outcome
+    return 'error'
+
+
+def _get_alias(obj):
+    # managers have a db; model instances record theirs in _state
+    alias = getattr(obj, 'db', None)
+    if alias is None and hasattr(obj, '_state'):
+        alias = obj._state.db
+    return alias or DEFAULT_DB_ALIAS
+
+
+class _QueryCounter(object):
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def instrument(operation, outcome=None):
+    """
+    Measure each call of the decorated method as operation. If given, outcome
+    is called with the method's result to name how it turned out; otherwise
+    it's 'ok'.
+    """
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                sinks = get_sinks()
+                if not sinks:
+                    return await func(self, *args, **kwargs)
+                start = perf_counter()
+                try:
+                    result = await func(self, *args, **kwargs)
+                except Exception as e:
+                    _record(
+                        sinks, operation, start, None, _exception_outcome(e),
+                    )
+                    raise
+                _record(
+                    sinks, operation, start, None,
+                    outcome(result) if outcome else 'ok',
+                )
+                return result
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            sinks = get_sinks()
+            if not sinks:
+                return func(self, *args, **kwargs)
+            counter = _QueryCounter()
+            start = perf_counter()
+            try:
+                with connections[_get_alias(self)].execute_wrapper(counter):
+                    result = func(self, *args, **kwargs)
+            except Exception as e:
+                _record(
+                    sinks, operation, start, counter.count,
+                    _exception_outcome(e),
+                )
+                raise
+            _record(
+                sinks, operation, start, counter.count,
+                outcome(result) if outcome else 'ok',
+            )
+            return result
+        return wrapper
+    return decorator
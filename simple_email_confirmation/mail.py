@@ -0,0 +1,114 @@
+"""
+Simple Email Confirmation emails
+
+Messages are rendered from the simple_email_confirmation/confirmation_subject.txt
+and simple_email_confirmation/confirmation_message.txt templates, plus
+confirmation_message.html if you provide one. Templates get the user, the
+email, the key and, if settings.SIMPLE_EMAIL_CONFIRMATION_URL is set, the
+confirmation_url. Each batch of messages is sent over a single connection.
+"""
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+
+from .exceptions import EmailConfirmationKeyNotStored
+from .models import chunked, get_key_mode
+
+SUBJECT_TEMPLATE = 'simple_email_confirmation/confirmation_subject.txt'
+MESSAGE_TEMPLATE = 'simple_email_confirmation/confirmation_message.txt'
+HTML_MESSAGE_TEMPLATE = 'simple_email_confirmation/confirmation_message.html'
+
+
+def get_confirmation_url(key):
+    # By default, messages carry the bare key. If you want a link instead,
+    # set settings.SIMPLE_EMAIL_CONFIRMATION_URL to a format string, e.g.
+    # 'https://example.com/confirm/{key}/'.
+    url = getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_URL', None)
+    return url.format(key=quote(key)) if url else None
+
+
+def build_message(user, email, key, from_email=None, connection=None):
+    "The confirmation message for an email address, unsent"
+    context = {
+        'user': user,
+        'email': email,
+        'key': key,
+        'confirmation_url': get_confirmation_url(key),
+    }
+    # subjects can't contain newlines
+    subject = ' '.join(render_to_string(SUBJECT_TEMPLATE, context).split())
+    body = render_to_string(MESSAGE_TEMPLATE, context)
+    # By default, messages are sent from settings.DEFAULT_FROM_EMAIL. If you
+    # want to change it, set settings.SIMPLE_EMAIL_CONFIRMATION_FROM_EMAIL.
+    from_email = from_email or getattr(
+        settings, 'SIMPLE_EMAIL_CONFIRMATION_FROM_EMAIL', None,
+    )
+    message = EmailMultiAlternatives(
+        subject, body, from_email, [email], connection=connection,
+    )
+    try:
+        html = render_to_string(HTML_MESSAGE_TEMPLATE, context)
+    except TemplateDoesNotExist:
+        pass
+    else:
+        message.attach_alternative(html, 'text/html')
+    return message
+
+
+def _get_key(address):
+    if address.raw_key is not None:
+        return address.raw_key
+    if get_key_mode() == 'plaintext':
+        return address.key
+    # only known when the key was generated
+    raise EmailConfirmationKeyNotStored()
+
+
+def send_confirmation_emails(addresses, from_email=None, batch_size=None,
+                             fail_silently=False, connection=None):
+    """
+    Send a confirmation message to each of an iterable of EmailAddress
+    objects, e.g. as returned by bulk_create_unconfirmed(). Each batch is sent
+    over one connection, opened once. Returns the number of messages sent.
+    """
+    # By default, batches are the size of the bulk creation ones.
+    batch_size = batch_size or getattr(
+        settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+    )
+    sent = 0
+    for chunk in chunked(addresses, batch_size):
+        batch_connection = connection or get_connection(
+            fail_silently=fail_silently,
+        )
+        messages = [
+            build_message(
+                address.user, address.email, _get_key(address),
+                from_email=from_email, connection=batch_connection,
+            )
+            for address in chunk
+        ]
+        sent += batch_connection.send_messages(messages) or 0
+    return sent
+
+
+def send_confirmation_email(user, email, key, from_email=None,
+                            fail_silently=False, connection=None):
+    """
+    Send the confirmation message for a key, as returned by
+    add_unconfirmed_email() or reset_email_confirmation()
+    """
+    message = build_message(
+        user, email, key, from_email=from_email, connection=connection,
+    )
+    return message.send(fail_silently=fail_silently)
+
+
+def send_on_unconfirmed_email_created(sender, user, email, key, **kwargs):
+    send_confirmation_email(user, email, key)
+
+
+def send_on_unconfirmed_emails_created(sender, addresses, **kwargs):
+    send_confirmation_emails(addresses)
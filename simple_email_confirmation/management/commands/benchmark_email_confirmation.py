@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from simple_email_confirmation.benchmarks import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the email confirmation operations on seeded Users and key '
+        'generation, and print the results as JSON, with the odds of keys '
+        'colliding. The seeded data is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Number of Users to seed.',
+        )
+        parser.add_argument(
+            '--addresses', type=int, default=2,
+            help='Confirmed addresses to seed per User, besides the primary.',
+        )
+        parser.add_argument(
+            '--iterations', type=int, default=None,
+            help='Number of Users to run each operation on. Defaults to all.',
+        )
+        parser.add_argument(
+            '--keys', type=int, default=100000,
+            help='Number of keys to generate when timing key generation.',
+        )
+        parser.add_argument(
+            '--database', default=None,
+            help='Database to run against.',
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write the results to, instead of stdout.',
+        )
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            users=options['users'],
+            addresses=options['addresses'],
+            iterations=options['iterations'],
+            using=options['database'],
+            keys=options['keys'],
+        )
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
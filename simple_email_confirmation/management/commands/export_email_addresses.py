@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from simple_email_confirmation.export import FORMATS, STATUSES, export_addresses
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise CommandError('{!r} is not a datetime'.format(value))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = (
+        'Export email addresses with their confirmation status as CSV or '
+        'JSON lines, streaming them from the database in chunks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=FORMATS, default='csv',
+            help='Output format.',
+        )
+        parser.add_argument(
+            '--output', default=None,
+            help='File to write to, instead of stdout.',
+        )
+        parser.add_argument(
+            '--status', choices=STATUSES, default=None,
+            help='Only export addresses with this status.',
+        )
+        parser.add_argument(
+            '--set-after', type=_datetime, default=None,
+            help='Only export addresses whose key was set at or after this.',
+        )
+        parser.add_argument(
+            '--set-before', type=_datetime, default=None,
+            help='Only export addresses whose key was set before this.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of addresses read per query.',
+        )
+
+    def handle(self, *args, **options):
+        output = None
+        if options['output']:
+            output = open(options['output'], 'w', newline='')
+
+        start = time.time()
+        try:
+            total = export_addresses(
+                output or self.stdout,
+                format=options['format'],
+                chunk_size=options['chunk_size'],
+                status=options['status'],
+                set_after=options['set_after'],
+                set_before=options['set_before'],
+            )
+        finally:
+            if output is not None:
+                output.close()
+
+        elapsed = time.time() - start
+        self.stderr.write(
+            'Exported {} addresses in {:.1f}s ({:.0f} rows/sec)'.format(
+                total, elapsed, total / elapsed if elapsed else 0,
+            )
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from simple_email_confirmation import get_email_address_model
+from simple_email_confirmation.models import get_key_mode
+
+
+class Command(BaseCommand):
+    help = (
+        'Replace confirmation keys stored in plaintext with their digests. '
+        "Run once after setting SIMPLE_EMAIL_CONFIRMATION_KEY_MODE to 'hashed'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Number of keys hashed per query.',
+        )
+
+    def handle(self, *args, **options):
+        if get_key_mode() != 'hashed':
+            raise CommandError(
+                "SIMPLE_EMAIL_CONFIRMATION_KEY_MODE must be 'hashed'; "
+                'hashed keys would not be usable otherwise.'
+            )
+
+        manager = get_email_address_model()._default_manager
+        total = 0
+        for hashed in manager.hash_stored_keys(batch_size=options['batch_size']):
+            total += hashed
+            self.stdout.write('Hashed {} keys (total {})'.format(hashed, total))
+        self.stdout.write('Hashed {} keys'.format(total))
@@ -0,0 +1,173 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from simple_email_confirmation import get_email_address_model
+
+
+class Command(BaseCommand):
+    help = (
+        'Import already-confirmed email addresses from a CSV or JSON lines '
+        'file, with an email column, a user column holding usernames or '
+        'primary keys, and an optional confirmed_at column. Rows are read '
+        'as a stream and inserted in batches, one transaction per batch. '
+        'Addresses the user already has are skipped. Rows for unknown users '
+        'stop the import unless --skip-unknown-users is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help="File to read, or '-' for stdin.",
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'), default=None,
+            help='Input format. By default, guessed from the file extension.',
+        )
+        parser.add_argument(
+            '--user-field', choices=('username', 'pk'), default='username',
+            help='What the user column holds.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Number of rows inserted per transaction.',
+        )
+        parser.add_argument(
+            '--skip-unknown-users', action='store_true',
+            help='Report rows for unknown users and go on, instead of failing.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Roll back every batch instead of committing it.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if format is None:
+            format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+        # By default, batches are the size of the bulk creation ones.
+        batch_size = options['batch_size'] or getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+        )
+
+        user_model = get_user_model()
+        if options['user_field'] == 'username':
+            self.user_lookup = user_model.USERNAME_FIELD
+        else:
+            self.user_lookup = 'pk'
+        self.dry_run = options['dry_run']
+        self.skip_unknown_users = options['skip_unknown_users']
+
+        file = sys.stdin if path == '-' else open(path, newline='')
+        try:
+            if format == 'csv':
+                records = csv.DictReader(file)
+            else:
+                records = (json.loads(line) for line in file if line.strip())
+            self.import_records(records, batch_size)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+    def import_records(self, records, batch_size):
+        total = created = skipped = unknown = 0
+        start = time.time()
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, batch_size))
+            if not chunk:
+                break
+            chunk_created, chunk_skipped, chunk_unknown = self.import_chunk(
+                chunk, total + 1,
+            )
+            total += len(chunk)
+            created += chunk_created
+            skipped += chunk_skipped
+            unknown += chunk_unknown
+            elapsed = time.time() - start
+            self.stdout.write(
+                '{} rows read, {} imported, {} skipped, {} unknown users '
+                '({:.0f} rows/sec)'.format(
+                    total, created, skipped, unknown,
+                    total / elapsed if elapsed else 0,
+                )
+            )
+
+        elapsed = time.time() - start
+        self.stdout.write(
+            '{} {} of {} addresses in {:.1f}s ({:.0f} rows/sec)'.format(
+                'Would import' if self.dry_run else 'Imported',
+                created, total, elapsed, total / elapsed if elapsed else 0,
+            )
+        )
+        if unknown:
+            self.stdout.write(
+                'Skipped {} rows for unknown users'.format(unknown),
+            )
+
+    def import_chunk(self, chunk, first_line):
+        triples = []
+        lines = []
+        for line, record in enumerate(chunk, first_line):
+            try:
+                user = str(record['user']).strip()
+                email = record['email'].strip()
+            except (KeyError, AttributeError):
+                raise CommandError(
+                    'Record {} needs user and email values'.format(line),
+                )
+            confirmed_at = record.get('confirmed_at') or None
+            if confirmed_at is not None:
+                confirmed_at = parse_datetime(confirmed_at)
+                if confirmed_at is None:
+                    raise CommandError(
+                        'Record {} has an invalid confirmed_at'.format(line),
+                    )
+                if timezone.is_naive(confirmed_at):
+                    confirmed_at = timezone.make_aware(confirmed_at)
+            triples.append((user, email, confirmed_at))
+            lines.append(line)
+
+        # one query resolves every user in the chunk
+        users = get_user_model()._default_manager.filter(**{
+            '{}__in'.format(self.user_lookup): set(user for user, _, _ in triples),
+        }).only('pk', self.user_lookup)
+        users = dict(
+            (str(getattr(user, self.user_lookup)), user) for user in users
+        )
+        unknown = [
+            (line, user)
+            for line, (user, _, _) in zip(lines, triples) if user not in users
+        ]
+        for line, user in unknown:
+            message = 'Record {} has an unknown user {!r}'.format(line, user)
+            if not self.skip_unknown_users:
+                raise CommandError(
+                    message + '; pass --skip-unknown-users to skip it',
+                )
+            self.stderr.write(message)
+        triples = [
+            (users[user], email, confirmed_at)
+            for user, email, confirmed_at in triples if user in users
+        ]
+
+        model = get_email_address_model()
+        using = router.db_for_write(model)
+        with transaction.atomic(using=using):
+            created = model._default_manager.db_manager(
+                using,
+            ).bulk_create_confirmed(triples, batch_size=len(chunk))
+            if self.dry_run:
+                transaction.set_rollback(True, using=using)
+        return (
+            len(created), len(triples) - len(created), len(unknown),
+        )
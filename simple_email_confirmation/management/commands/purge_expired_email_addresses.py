@@ -0,0 +1,82 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from simple_email_confirmation import get_email_address_model
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete unconfirmed email addresses whose confirmation key has '
+        'expired, in batches. Does nothing unless '
+        'SIMPLE_EMAIL_CONFIRMATION_PERIOD is set.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Number of addresses deleted per query.',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Seconds to pause between batches.',
+        )
+        parser.add_argument(
+            '--start-after', default=None,
+            help='Resume after this primary key, as reported by a prior run.',
+        )
+        parser.add_argument(
+            '--archive', default=None,
+            help='Append deleted addresses to this file as JSON lines.',
+        )
+        parser.add_argument(
+            '--include-primary', action='store_true',
+            help="Also delete addresses that are a User's primary email.",
+        )
+
+    def handle(self, *args, **options):
+        manager = get_email_address_model()._default_manager
+
+        archive_file = None
+        archive = None
+        if options['archive']:
+            archive_file = open(options['archive'], 'a')
+
+            def archive(addresses):
+                for address in addresses:
+                    archive_file.write(json.dumps({
+                        'pk': str(address.pk),
+                        'user': str(address.user_id),
+                        'email': address.email,
+                        'set_at': address.set_at.isoformat(),
+                    }) + '\n')
+                archive_file.flush()
+
+        total = 0
+        start = time.time()
+        try:
+            batches = manager.purge_expired(
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                start_after=options['start_after'],
+                archive=archive,
+                include_primary=options['include_primary'],
+            )
+            for deleted, last_pk in batches:
+                total += deleted
+                self.stdout.write(
+                    'Deleted {} addresses (total {}, last pk {})'.format(
+                        deleted, total, last_pk,
+                    )
+                )
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+        elapsed = time.time() - start
+        self.stdout.write(
+            'Deleted {} expired addresses in {:.1f}s ({:.0f} rows/sec)'.format(
+                total, elapsed, total / elapsed if elapsed else 0,
+            )
+        )
@@ -0,0 +1,24 @@
+"Simple Email Confirmation process-wide counters, for monitoring"
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def incr(name, amount=1):
+    "Increase the counter called name"
+    with _lock:
+        _counters[name] += amount
+
+
+def get_counters():
+    "Current value of every counter that has been increased, by name"
+    with _lock:
+        return dict(_counters)
+
+
+def reset_counters():
+    "Set every counter back to zero"
+    with _lock:
+        _counters.clear()
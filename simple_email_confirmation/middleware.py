@@ -0,0 +1,26 @@
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import empty
+
+from . import cache as status_cache
+
+
+class EmailConfirmationStatusMiddleware(MiddlewareMixin):
+    """
+    Memoize Users' email addresses for the length of each request, so that
+    status lookups on request.user, or on any other instance of the same User,
+    read them from the database at most once. Add it after
+    AuthenticationMiddleware.
+    """
+
+    def process_request(self, request):
+        status_cache.start_request_memo()
+
+    def process_response(self, request, response):
+        status_cache.end_request_memo()
+        user = getattr(request, 'user', None)
+        # don't load a lazy request.user that the request never touched
+        if getattr(user, '_wrapped', None) is empty:
+            return response
+        if hasattr(user, 'clear_email_address_cache'):
+            user.clear_email_address_cache()
+        return response
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.functions
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_email_confirmation', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emailaddress',
+            index=models.Index(fields=['email'], name='sec_emailaddress_email'),
+        ),
+        migrations.AddIndex(
+            model_name='emailaddress',
+            index=models.Index(django.db.models.functions.Upper('email'), name='sec_emailaddress_email_ci'),
+        ),
+        migrations.AddIndex(
+            model_name='emailaddress',
+            index=models.Index(condition=models.Q(confirmed_at__isnull=True), fields=['set_at'], name='sec_emailaddress_pending'),
+        ),
+    ]
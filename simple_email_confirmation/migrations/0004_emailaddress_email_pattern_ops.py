@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('simple_email_confirmation', '0003_signedkeyrevocation'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='emailaddress',
+            name='sec_emailaddress_email',
+        ),
+        migrations.AddIndex(
+            model_name='emailaddress',
+            index=models.Index(fields=['email'], name='sec_emailaddress_email', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
@@ -1,25 +1,230 @@
 from __future__ import unicode_literals
 
+from base64 import urlsafe_b64encode
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime, timezone as dt_timezone
+from hashlib import sha256
+from itertools import islice
+import secrets
+import string
+import time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models.signals import post_save
-from django.utils.crypto import get_random_string
+from django.core.exceptions import ImproperlyConfigured
+from django.core import signing
+from django.db import (
+    IntegrityError, connections, models, router, transaction,
+)
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.functions import Upper
+from django.db.models.sql import UpdateQuery
 from django.utils import timezone
 from six import python_2_unicode_compatible
-import django
-if django.VERSION < (4, 0):
-    from django.utils.translation import ugettext_lazy as _
-else:
-    from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _
 
 from simple_email_confirmation import get_email_address_model
+from . import cache as status_cache
+from . import dispatch, metrics, throttling
+from .instrumentation import instrument
 from .exceptions import (
-    EmailConfirmationExpired, EmailIsPrimary, EmailNotConfirmed,
+    EmailConfirmationExpired, EmailConfirmationKeyNotStored,
+    EmailConfirmationThrottled, EmailIsPrimary, EmailNotConfirmed,
 )
 from .signals import (
-    email_confirmed, unconfirmed_email_created, primary_email_changed,
+    email_confirmed, emails_confirmed, unconfirmed_email_created,
+    primary_email_changed, primary_emails_changed,
+    unconfirmed_emails_created,
+)
+
+
+def get_confirmation_period():
+    # By default, keys don't expire. If you want them to, set
+    # settings.SIMPLE_EMAIL_CONFIRMATION_PERIOD to a timedelta.
+    return getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_PERIOD', None)
+
+
+KEY_MODES = ('plaintext', 'hashed', 'signed')
+
+# prefix of hashed keys as stored; it can't appear in a generated key
+HASHED_KEY_PREFIX = '$'
+
+SIGNED_KEY_SALT = 'simple_email_confirmation.signed_key'
+
+
+def get_key_mode():
+    # By default, confirmation keys are stored as generated. If you want
+    # only a digest of each key stored, set
+    # settings.SIMPLE_EMAIL_CONFIRMATION_KEY_MODE to 'hashed'. If you want
+    # keys signed with SECRET_KEY instead, and unconfirmed addresses not
+    # written until they're confirmed, set it to 'signed'.
+    mode = getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_KEY_MODE', 'plaintext')
+    if mode not in KEY_MODES:
+        raise ImproperlyConfigured(
+            'SIMPLE_EMAIL_CONFIRMATION_KEY_MODE must be one of {}'.format(
+                ', '.join(KEY_MODES),
+            )
+        )
+    if mode == 'signed' and get_confirmation_period() is None:
+        # unstored keys are only revoked by the records kept for a period
+        raise ImproperlyConfigured(
+            'Signed key mode needs SIMPLE_EMAIL_CONFIRMATION_PERIOD set'
+        )
+    return mode
+
+
+def _dump_key_time(value):
+    # datetimes carried by signed keys, in UTC where time zones are used
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc)
+    return value.isoformat()
+
+
+def _load_key_time(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _key_not_revoked(issued_at, revoked_at):
+    # keys made before they carried the time are refused by any revocation
+    if revoked_at is None:
+        return True
+    return issued_at is not None and issued_at > revoked_at
+
+
+# the characters of get_random_string(), which keys were generated with
+KEY_ALPHABET = string.ascii_letters + string.digits
+
+# random bytes map onto the alphabet four times over; the few bytes above
+# that are dropped, so that every character is equally likely
+_KEY_BYTES = bytes(range(len(KEY_ALPHABET) * (256 // len(KEY_ALPHABET))))
+_KEY_TABLE = bytes.maketrans(
+    _KEY_BYTES, (KEY_ALPHABET * (256 // len(KEY_ALPHABET))).encode('ascii'),
 )
+_KEY_REJECTED = bytes(range(len(_KEY_BYTES), 256))
+
+# inserts of an address are retried this many times with new keys while
+# its key collides with a stored one
+KEY_ATTEMPTS = 5
+
+
+def get_key_length():
+    # By default, a length of keys is 12. If you want to change it, set
+    # settings.SIMPLE_EMAIL_CONFIRMATION_KEY_LENGTH to integer value (max 40).
+    return min(getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_KEY_LENGTH', 12), 40)
+
+
+def random_keys(count, length):
+    "Generate a list of count random keys of length characters"
+    needed = count * length
+    chars = b''
+    while len(chars) < needed:
+        # the entropy for every key is drawn at once, with a margin for the
+        # dropped bytes, rather than once per character
+        missing = needed - len(chars)
+        chars += secrets.token_bytes(missing + missing // 16 + 8).translate(
+            _KEY_TABLE, _KEY_REJECTED,
+        )
+    chars = chars[:needed].decode('ascii')
+    return [chars[i:i + length] for i in range(0, needed, length)]
+
+
+def _key_savepoint(using):
+    # a failed insert only spoils an enclosing transaction; in autocommit
+    # mode there's nothing to roll back to, so no round trips are spent
+    if connections[using].in_atomic_block:
+        return transaction.atomic(using=using)
+    return nullcontext()
+
+
+def hash_key(key):
+    "Fixed-width digest of a confirmation key, as stored in hashed mode"
+    # 128 bits keep the unique index small and are plenty for random keys
+    digest = sha256(key.encode('utf-8')).digest()[:16]
+    encoded = urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+    return HASHED_KEY_PREFIX + encoded
+
+
+def _can_update_returning(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _update_returning(queryset, values):
+    """
+    Apply queryset.update(**values) with a single UPDATE ... RETURNING
+    statement. Returns the updated object, or None if no row matched.
+    queryset must match at most one row.
+    """
+    updated = _update_returning_all(queryset, values)
+    return updated[0] if updated else None
+
+
+def _update_returning_all(queryset, values):
+    """
+    Apply queryset.update(**values) with a single UPDATE ... RETURNING
+    statement. Returns the list of updated objects.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    # as in QuerySet.update(), annotations only matter to the filters
+    query.annotations = {}
+    update_sql, params = query.get_compiler(queryset.db).as_sql()
+
+    fields = model._meta.concrete_fields
+    returning = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '{} RETURNING {}'.format(update_sql, returning), params,
+        )
+        rows = cursor.fetchall()
+
+    converters = []
+    for field in fields:
+        col = field.get_col(model._meta.db_table)
+        converters.append((col, (
+            connection.ops.get_db_converters(col) +
+            col.get_db_converters(connection)
+        )))
+    updated = []
+    for row in rows:
+        converted = []
+        for (col, field_converters), value in zip(converters, row):
+            for converter in field_converters:
+                value = converter(value, col, connection)
+            converted.append(value)
+        updated.append(model.from_db(
+            queryset.db, [field.attname for field in fields], converted,
+        ))
+    return updated
+
+
+def _confirmed_outcome(result):
+    # set by EmailAddressManager.confirm(), which returns only the address
+    return result._confirm_outcome
+
+
+def _confirm_once_outcome(result):
+    return 'confirmed' if result[1] else 'already_confirmed'
+
+
+def chunked(iterable, size):
+    "Yield successive lists of at most size items from iterable"
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
 
 
 class SimpleEmailConfirmationUserMixin(object):
@@ -36,9 +241,56 @@ class SimpleEmailConfirmationUserMixin(object):
 
     primary_email_field_name = 'email'
 
+    # The User's EmailAddress rows are loaded with a single query the first
+    # time a status property or getter needs them, then memoized on the
+    # instance. If they were loaded by prefetch_related('email_address_set'),
+    # no query is made at all. Mutating methods on this mixin clear the memo;
+    # if you change a User's addresses some other way, call
+    # clear_email_address_cache(). While EmailConfirmationStatusMiddleware
+    # handles a request, they're shared between instances of the same User,
+    # and with settings.SIMPLE_EMAIL_CONFIRMATION_CACHE set, between requests.
+
+    @instrument('user.get_email_addresses')
+    def get_email_addresses(self):
+        "List of this User's EmailAddress objects"
+        addresses = self.__dict__.get('_email_address_snapshot')
+        if addresses is None:
+            prefetched = getattr(self, '_prefetched_objects_cache', {})
+            if 'email_address_set' in prefetched:
+                addresses = list(prefetched['email_address_set'])
+            else:
+                addresses = status_cache.get_addresses(self)
+                if addresses is None:
+                    addresses = list(self.email_address_set.all())
+                    status_cache.set_addresses(self, addresses)
+            self._email_address_snapshot = addresses
+        return addresses
+
+    def clear_email_address_cache(self):
+        "Forget the EmailAddress objects loaded by get_email_addresses()"
+        self.__dict__.pop('_email_address_snapshot', None)
+        prefetched = getattr(self, '_prefetched_objects_cache', {})
+        prefetched.pop('email_address_set', None)
+        status_cache.forget_memoized([self.pk])
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.clear_email_address_cache()
+        super(SimpleEmailConfirmationUserMixin, self).refresh_from_db(
+            *args, **kwargs
+        )
+
+    def _get_email_address(self, email):
+        for address in self.get_email_addresses():
+            if address.email == email:
+                return address
+        raise self.email_address_set.model.DoesNotExist(
+            'Email address matching query does not exist.'
+        )
+
     def get_primary_email(self):
         return getattr(self, self.primary_email_field_name)
 
+    @instrument('user.set_primary_email')
     def set_primary_email(self, email, require_confirmed=True):
         "Set an email address as primary"
         old_email = self.get_primary_email()
@@ -49,8 +301,12 @@ class SimpleEmailConfirmationUserMixin(object):
             raise EmailNotConfirmed()
 
         setattr(self, self.primary_email_field_name, email)
+        self.clear_email_address_cache()
         self.save(update_fields=[self.primary_email_field_name])
-        primary_email_changed.send(
+        status_cache.invalidate([self.pk])
+        dispatch.send(
+            primary_email_changed,
+            using=self._state.db,
             sender=self.__class__,
             user=self,
             old_email=old_email,
@@ -65,7 +321,13 @@ class SimpleEmailConfirmationUserMixin(object):
     @property
     def confirmed_at(self):
         "When the User's primary email address was confirmed, or None"
-        address = self.email_address_set.get(email=self.get_primary_email())
+        try:
+            address = self._get_email_address(self.get_primary_email())
+        except self.email_address_set.model.DoesNotExist:
+            if get_key_mode() == 'signed':
+                # unconfirmed addresses aren't stored
+                return None
+            raise
         return address.confirmed_at
 
     @property
@@ -91,48 +353,73 @@ class SimpleEmailConfirmationUserMixin(object):
     def get_confirmation_key(self, email=None):
         "Get the confirmation key for an email"
         email = email or self.get_primary_email()
-        address = self.email_address_set.get(email=email)
+        if get_key_mode() == 'signed':
+            try:
+                set_at = self._get_email_address(email).set_at
+            except self.email_address_set.model.DoesNotExist:
+                set_at = None
+            return self.email_address_set.make_signed_key(
+                self.pk, email, set_at,
+            )
+        if get_key_mode() == 'hashed':
+            # only returned by add_*_email() and reset_email_confirmation()
+            raise EmailConfirmationKeyNotStored()
+        address = self._get_email_address(email)
         return address.key
 
     def get_confirmed_emails(self):
         "List of emails this User has confirmed"
-        address_qs = self.email_address_set.filter(confirmed_at__isnull=False)
-        return [address.email for address in address_qs]
+        return [
+            address.email for address in self.get_email_addresses()
+            if address.is_confirmed
+        ]
 
     def get_unconfirmed_emails(self):
         "List of emails this User has been associated with but not confirmed"
-        address_qs = self.email_address_set.filter(confirmed_at__isnull=True)
-        return [address.email for address in address_qs]
+        return [
+            address.email for address in self.get_email_addresses()
+            if not address.is_confirmed
+        ]
 
     def confirm_email(self, confirmation_key, save=True):
         """
         Attempt to confirm an email using the given key.
         Returns the email that was confirmed, or raise an exception.
         """
-        address = self.email_address_set.confirm(confirmation_key, save=save, user=self)
-        return address.email
+        return self._confirm_email(confirmation_key, save).email
+
+    @instrument('user.confirm_email', outcome=_confirmed_outcome)
+    def _confirm_email(self, confirmation_key, save):
+        self.clear_email_address_cache()
+        return self.email_address_set.confirm(confirmation_key, save=save, user=self)
 
+    @instrument('user.add_confirmed_email')
     def add_confirmed_email(self, email):
         "Adds an email to the user that's already in the confirmed state"
         # if email already exists, let exception be thrown
+        self.clear_email_address_cache()
         address = self.email_address_set.create_confirmed(email)
-        return address.key
+        return address.raw_key
 
+    @instrument('user.add_unconfirmed_email')
     def add_unconfirmed_email(self, email):
         "Adds an unconfirmed email address and returns it's confirmation key"
         # if email already exists, let exception be thrown
+        self.clear_email_address_cache()
         address = self.email_address_set.create_unconfirmed(email)
-        return address.key
+        return address.raw_key
 
+    @instrument('user.add_email_if_not_exists')
     def add_email_if_not_exists(self, email):
         """
         If the user already has the email, and it's confirmed, do nothing
         and return None.
 
         If the user already has the email, and it's unconfirmed, reset the
-        confirmation. If the confirmation is unexpired, do nothing. Return
+        confirmation, unless it was reset within the resend cooldown. Return
         the confirmation key of the email.
         """
+        self.clear_email_address_cache()
         try:
             address = self.email_address_set.get(email=email)
         except get_email_address_model().DoesNotExist:
@@ -145,79 +432,1033 @@ class SimpleEmailConfirmationUserMixin(object):
 
         return key
 
+    @instrument('user.reset_email_confirmation')
     def reset_email_confirmation(self, email):
         "Reset the expiration of an email confirmation"
+        self.clear_email_address_cache()
         address = self.email_address_set.get(email=email)
         return address.reset_confirmation()
 
+    @instrument('user.remove_email')
     def remove_email(self, email):
         "Remove an email address"
         # if email already exists, let exception be thrown
         if email == self.get_primary_email():
             raise EmailIsPrimary()
+        self.clear_email_address_cache()
         address = self.email_address_set.get(email=email)
         address.delete()
+        self.email_address_set.revoke_signed_keys([(self.pk, email)])
+        status_cache.invalidate_saved([self.pk])
+
+    # Async counterparts of the methods above, for use from async views.
+    # Each makes at most one trip to the database thread per query it
+    # needs, and none when the User's addresses are already loaded.
+
+    @instrument('user.aget_email_addresses')
+    async def aget_email_addresses(self):
+        "Async version of get_email_addresses()"
+        addresses = self.__dict__.get('_email_address_snapshot')
+        if addresses is None:
+            prefetched = getattr(self, '_prefetched_objects_cache', {})
+            if 'email_address_set' in prefetched:
+                addresses = list(prefetched['email_address_set'])
+            else:
+                addresses = await status_cache.aget_addresses(self)
+                if addresses is None:
+                    addresses = [
+                        address async for address in self.email_address_set.all()
+                    ]
+                    await status_cache.aset_addresses(self, addresses)
+            self._email_address_snapshot = addresses
+        return addresses
+
+    async def ais_confirmed(self):
+        "Async version of is_confirmed"
+        return self.get_primary_email() in await self.aget_confirmed_emails()
+
+    async def aget_confirmed_emails(self):
+        "Async version of get_confirmed_emails()"
+        return [
+            address.email for address in await self.aget_email_addresses()
+            if address.is_confirmed
+        ]
+
+    async def aget_unconfirmed_emails(self):
+        "Async version of get_unconfirmed_emails()"
+        return [
+            address.email for address in await self.aget_email_addresses()
+            if not address.is_confirmed
+        ]
+
+    @instrument('user.aset_primary_email')
+    async def aset_primary_email(self, email, require_confirmed=True):
+        "Async version of set_primary_email()"
+        old_email = self.get_primary_email()
+        if email == old_email:
+            return
+
+        confirmed_emails = await self.aget_confirmed_emails()
+        if email not in confirmed_emails and require_confirmed:
+            raise EmailNotConfirmed()
+
+        setattr(self, self.primary_email_field_name, email)
+        self.clear_email_address_cache()
+        await self.asave(update_fields=[self.primary_email_field_name])
+        await status_cache.ainvalidate([self.pk])
+        await dispatch.asend(
+            primary_email_changed,
+            sender=self.__class__,
+            user=self,
+            old_email=old_email,
+            new_email=email,
+        )
+
+    async def aconfirm_email(self, confirmation_key, save=True):
+        "Async version of confirm_email()"
+        address = await self._aconfirm_email(confirmation_key, save)
+        return address.email
+
+    @instrument('user.aconfirm_email', outcome=_confirmed_outcome)
+    async def _aconfirm_email(self, confirmation_key, save):
+        self.clear_email_address_cache()
+        return await self.email_address_set.aconfirm(
+            confirmation_key, save=save, user=self,
+        )
+
+    @instrument('user.aadd_confirmed_email')
+    async def aadd_confirmed_email(self, email):
+        "Async version of add_confirmed_email()"
+        self.clear_email_address_cache()
+        address = await self.email_address_set.acreate_confirmed(email)
+        return address.raw_key
+
+    @instrument('user.aadd_unconfirmed_email')
+    async def aadd_unconfirmed_email(self, email):
+        "Async version of add_unconfirmed_email()"
+        self.clear_email_address_cache()
+        address = await self.email_address_set.acreate_unconfirmed(email)
+        return address.raw_key
+
+    @instrument('user.aadd_email_if_not_exists')
+    async def aadd_email_if_not_exists(self, email):
+        "Async version of add_email_if_not_exists()"
+        self.clear_email_address_cache()
+        try:
+            address = await self.email_address_set.aget(email=email)
+        except get_email_address_model().DoesNotExist:
+            key = await self.aadd_unconfirmed_email(email)
+        else:
+            if not address.is_confirmed:
+                key = await address.areset_confirmation()
+            else:
+                key = None
+
+        return key
+
+    @instrument('user.areset_email_confirmation')
+    async def areset_email_confirmation(self, email):
+        "Async version of reset_email_confirmation()"
+        self.clear_email_address_cache()
+        address = await self.email_address_set.aget(email=email)
+        return await address.areset_confirmation()
+
+    @instrument('user.aremove_email')
+    async def aremove_email(self, email):
+        "Async version of remove_email()"
+        if email == self.get_primary_email():
+            raise EmailIsPrimary()
+        self.clear_email_address_cache()
+        address = await self.email_address_set.aget(email=email)
+        await address.adelete()
+        await sync_to_async(self.email_address_set.revoke_signed_keys)(
+            [(self.pk, email)],
+        )
+        await status_cache.ainvalidate_saved([self.pk])
+
+
+class SimpleEmailConfirmationUserQuerySetMixin(object):
+    """
+    Mixin to be used with the QuerySet of your custom User model's manager.
+    """
+
+    def with_email_status(self):
+        "Load each User's email addresses up front, in a single query"
+        return self.prefetch_related('email_address_set')
+
+    def annotate_primary_confirmed(self, name='primary_email_confirmed'):
+        "Annotate each User with whether their primary email is confirmed"
+        return self.annotate(**{name: self._primary_confirmed_exists()})
+
+    def primary_email_confirmed(self):
+        "Users whose primary email address is confirmed"
+        return self.filter(self._primary_confirmed_exists())
+
+    def primary_email_unconfirmed(self):
+        "Users whose primary email address is not confirmed"
+        return self.filter(~self._primary_confirmed_exists())
+
+    def _primary_confirmed_exists(self):
+        address_model = self.model._meta.get_field(
+            'email_address_set'
+        ).related_model
+        field_name = getattr(self.model, 'primary_email_field_name', 'email')
+        return Exists(address_model._default_manager.filter(
+            user=OuterRef('pk'),
+            email=OuterRef(field_name),
+            confirmed_at__isnull=False,
+        ))
 
 
-class EmailAddressManager(models.Manager):
+class EmailAddressQuerySet(models.QuerySet):
+
+    def confirmed(self):
+        "Email addresses that have been confirmed"
+        return self.filter(confirmed_at__isnull=False)
+
+    def unconfirmed(self):
+        "Email addresses that haven't been confirmed"
+        return self.filter(confirmed_at__isnull=True)
+
+    def expired(self):
+        "Email addresses whose confirmation key has expired"
+        cutoff = self._expiry_cutoff()
+        if cutoff is None:
+            return self.none()
+        return self.filter(set_at__lte=cutoff)
+
+    def unexpired(self):
+        "Email addresses whose confirmation key has not expired"
+        cutoff = self._expiry_cutoff()
+        if cutoff is None:
+            return self.all()
+        return self.filter(set_at__gt=cutoff)
+
+    def not_primary(self):
+        "Email addresses that aren't their User's primary email"
+        user_model = self.model._meta.get_field('user').related_model
+        field_name = getattr(user_model, 'primary_email_field_name', 'email')
+        return self.exclude(Exists(
+            user_model._default_manager.filter(
+                pk=OuterRef('user'), **{field_name: OuterRef('email')}
+            )
+        ))
+
+    def status_counts(self):
+        "Count confirmed, unconfirmed and expired unconfirmed addresses"
+        aggregates = {
+            'confirmed': Count('pk', filter=Q(confirmed_at__isnull=False)),
+            'unconfirmed': Count('pk', filter=Q(confirmed_at__isnull=True)),
+        }
+        cutoff = self._expiry_cutoff()
+        if cutoff is not None:
+            aggregates['expired'] = Count('pk', filter=Q(
+                confirmed_at__isnull=True, set_at__lte=cutoff,
+            ))
+        counts = self.aggregate(**aggregates)
+        counts.setdefault('expired', 0)
+        return counts
+
+    def _expiry_cutoff(self):
+        # a key is expired once set_at + period is not in the future
+        period = get_confirmation_period()
+        return timezone.now() - period if period is not None else None
+
+
+class EmailAddressManager(models.Manager.from_queryset(EmailAddressQuerySet)):
 
     def generate_key(self):
         "Generate a new random key and return it"
-        # By default, a length of keys is 12. If you want to change it, set
-        # settings.SIMPLE_EMAIL_CONFIRMATION_KEY_LENGTH to integer value (max 40).
-        return get_random_string(
-            length=min(getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_KEY_LENGTH', 12), 40)
+        return random_keys(1, get_key_length())[0]
+
+    def generate_keys(self, count):
+        "Generate a list of count new random keys"
+        return random_keys(count, get_key_length())
+
+    def generate_unused_keys(self, count):
+        """
+        Generate a list of count new random keys that differ from each other
+        and from the stored ones, checking the stored ones in one query
+        """
+        keys = self.generate_keys(count)
+        manager = self.model._default_manager.db_manager(self.db)
+        while True:
+            stored = dict(
+                (self.get_stored_key(key), i) for i, key in enumerate(keys)
+            )
+            taken = set(manager.filter(
+                key__in=list(stored),
+            ).values_list('key', flat=True))
+            # keys repeated within the list are only stored once above
+            repeated = set(range(len(keys))) - set(stored.values())
+            retry = sorted(repeated | set(stored[key] for key in taken))
+            if not retry:
+                return keys
+            metrics.incr('key.collisions', len(retry))
+            for i, key in zip(retry, self.generate_keys(len(retry))):
+                keys[i] = key
+
+    def get_stored_key(self, key):
+        "The value stored in the key column for a confirmation key"
+        if get_key_mode() == 'hashed':
+            return hash_key(key)
+        return key
+
+    def _key_lookup(self, key):
+        if get_key_mode() != 'hashed':
+            return {'key': key}
+        if key.startswith(HASHED_KEY_PREFIX):
+            # never match a stored digest given as the key itself
+            return {'key': hash_key(key)}
+        # also accept keys stored before hashing was turned on
+        return {'key__in': [hash_key(key), key]}
+
+    def hash_stored_keys(self, batch_size=None):
+        """
+        Replace keys stored before hashed key mode was turned on with their
+        digests, in batches. Yields the number of keys hashed per batch.
+        """
+        batch_size = batch_size or getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
         )
+        queryset = self.exclude(key__startswith=HASHED_KEY_PREFIX)
+        cursor = None
+        while True:
+            batch = queryset.order_by('pk')
+            if cursor is not None:
+                batch = batch.filter(pk__gt=cursor)
+            addresses = list(batch.only('pk', 'user_id', 'key')[:batch_size])
+            if not addresses:
+                return
+            for address in addresses:
+                address.key = hash_key(address.key)
+            self.bulk_update(addresses, ['key'])
+            status_cache.invalidate(
+                [address.user_id for address in addresses], using=self.db,
+            )
+            cursor = addresses[-1].pk
+            yield len(addresses)
 
+    @instrument('manager.create_confirmed')
     def create_confirmed(self, email, user=None):
         "Create an email address in the confirmed state"
         user = user or getattr(self, 'instance', None)
         if not user:
             raise ValueError('Must specify user or call from related manager')
-        key = self.generate_key()
         now = timezone.now()
         # let email-already-exists exception propogate through
-        address = self.create(
-            user=user, email=email, key=key, set_at=now, confirmed_at=now,
+        address = self._create_with_key(
+            user=user, email=email, set_at=now, confirmed_at=now,
         )
+        status_cache.invalidate_saved([user.pk], using=self.db)
+        if get_key_mode() == 'signed':
+            address.raw_key = self.make_signed_key(user.pk, email, now)
         return address
 
+    @instrument('manager.create_unconfirmed')
     def create_unconfirmed(self, email, user=None):
         "Create an email address in the unconfirmed state"
         user = user or getattr(self, 'instance', None)
         if not user:
             raise ValueError('Must specify user or call from related manager')
-        key = self.generate_key()
-        # let email-already-exists exception propogate through
-        address = self.create(user=user, email=email, key=key)
-        unconfirmed_email_created.send(
+        if get_key_mode() == 'signed':
+            # nothing is written until the address is confirmed, but a
+            # stored one raises as it would in the other modes
+            self._check_not_stored(user, email)
+            key = self.make_signed_key(user.pk, email)
+            address = self.model(user=user, email=email, key='')
+        else:
+            # let email-already-exists exception propogate through
+            address = self._create_with_key(user=user, email=email)
+            key = address.raw_key
+            status_cache.invalidate_saved([user.pk], using=self.db)
+        address.raw_key = key
+        dispatch.send(
+            unconfirmed_email_created,
+            using=self.db,
+            sender=user.__class__,
+            user=user,
+            email=email,
+            key=key,
+        )
+        return address
+
+    @instrument('manager.acreate_confirmed')
+    async def acreate_confirmed(self, email, user=None):
+        "Async version of create_confirmed()"
+        user = user or getattr(self, 'instance', None)
+        if not user:
+            raise ValueError('Must specify user or call from related manager')
+        now = timezone.now()
+        address = await sync_to_async(self._create_with_key)(
+            user=user, email=email, set_at=now, confirmed_at=now,
+        )
+        await status_cache.ainvalidate_saved([user.pk])
+        if get_key_mode() == 'signed':
+            address.raw_key = self.make_signed_key(user.pk, email, now)
+        return address
+
+    @instrument('manager.acreate_unconfirmed')
+    async def acreate_unconfirmed(self, email, user=None):
+        "Async version of create_unconfirmed()"
+        user = user or getattr(self, 'instance', None)
+        if not user:
+            raise ValueError('Must specify user or call from related manager')
+        if get_key_mode() == 'signed':
+            await sync_to_async(self._check_not_stored)(user, email)
+            key = self.make_signed_key(user.pk, email)
+            address = self.model(user=user, email=email, key='')
+        else:
+            address = await sync_to_async(self._create_with_key)(
+                user=user, email=email,
+            )
+            key = address.raw_key
+            await status_cache.ainvalidate_saved([user.pk])
+        address.raw_key = key
+        await dispatch.asend(
+            unconfirmed_email_created,
             sender=user.__class__,
             user=user,
             email=email,
+            key=key,
         )
         return address
 
+    def _check_not_stored(self, user, email):
+        manager = self.model._default_manager.db_manager(self.db)
+        if manager.filter(user=user, email=email).exists():
+            raise IntegrityError(
+                'Email address {} already exists for this user'.format(email)
+            )
+
+    def _create_with_key(self, user, email, **fields):
+        # a key colliding with a stored one is replaced and the insert
+        # retried, after rolling back to a savepoint
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        manager = self.model._default_manager.db_manager(using)
+        for attempt in range(1, KEY_ATTEMPTS + 1):
+            key = self.generate_key()
+            stored_key = self.get_stored_key(key)
+            try:
+                with _key_savepoint(using):
+                    address = self.create(
+                        user=user, email=email, key=stored_key, **fields
+                    )
+            except IntegrityError:
+                if (
+                    attempt == KEY_ATTEMPTS or
+                    manager.filter(user=user, email=email).exists() or
+                    not manager.filter(key=stored_key).exists()
+                ):
+                    raise
+                metrics.incr('key.collisions')
+            else:
+                address.raw_key = key
+                return address
+
+    @instrument('manager.bulk_create_confirmed')
+    def bulk_create_confirmed(self, pairs, batch_size=None):
+        """
+        Create email addresses in the confirmed state from an iterable of
+        (user, email) pairs, or (user, email, confirmed_at) triples to record
+        when they were confirmed. Returns the list of addresses created.
+        """
+        return self._bulk_create(pairs, batch_size, confirmed=True)
+
+    @instrument('manager.bulk_create_unconfirmed')
+    def bulk_create_unconfirmed(self, pairs, batch_size=None):
+        """
+        Create email addresses in the unconfirmed state from an iterable of
+        (user, email) pairs. Sends one unconfirmed_emails_created signal per
+        batch. Returns the list of addresses created.
+        """
+        return self._bulk_create(pairs, batch_size, confirmed=False)
+
+    def _bulk_create(self, pairs, batch_size, confirmed):
+        # By default, rows are inserted 1000 at a time. If you want to change
+        # it, set settings.SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE.
+        batch_size = batch_size or getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+        )
+        created = []
+        for chunk in chunked(pairs, batch_size):
+            addresses = self._bulk_create_chunk(chunk, confirmed)
+            if addresses and not confirmed:
+                dispatch.send(
+                    unconfirmed_emails_created,
+                    using=self.db,
+                    sender=get_user_model(),
+                    addresses=addresses,
+                )
+            created.extend(addresses)
+        return created
+
+    def _bulk_create_chunk(self, pairs, confirmed):
+        # pairs already present, either earlier in this chunk or in the
+        # database, are skipped rather than raising like create_*() does
+        # filtering on users alone: adding email__in lets SQLite probe the
+        # (user, email) index once per user and email combination
+        existing = set(self.filter(
+            user__in=set(item[0].pk for item in pairs),
+        ).values_list('user_id', 'email'))
+
+        new_pairs = []
+        for item in pairs:
+            user, email = item[0], item[1]
+            if (user.pk, email) not in existing:
+                existing.add((user.pk, email))
+                new_pairs.append(item)
+
+        now = timezone.now()
+        signed = get_key_mode() == 'signed'
+        if signed and not confirmed:
+            keys = self.generate_keys(len(new_pairs))
+        else:
+            # a colliding key would have its row skipped by ignore_conflicts
+            keys = self.generate_unused_keys(len(new_pairs))
+        addresses = []
+        for item, key in zip(new_pairs, keys):
+            user, email = item[0], item[1]
+            # confirmed addresses may say when they were confirmed
+            set_at = (item[2] if confirmed and len(item) > 2 else None) or now
+            address = self.model(
+                user=user, email=email, key=self.get_stored_key(key),
+                set_at=set_at, confirmed_at=set_at if confirmed else None,
+            )
+            address.raw_key = key
+            if signed:
+                address.raw_key = self.make_signed_key(
+                    user.pk, email, set_at if confirmed else None,
+                )
+            addresses.append(address)
+
+        if signed and not confirmed:
+            # nothing is written until the addresses are confirmed
+            return addresses
+        # a concurrent insert of the same (user, email) is skipped too
+        self.bulk_create(addresses, ignore_conflicts=True)
+        addresses = self._stored_only(addresses)
+        status_cache.invalidate(
+            [address.user_id for address in addresses], using=self.db,
+        )
+        return addresses
+
+    def _stored_only(self, addresses):
+        # bulk_create(ignore_conflicts=True) doesn't say which rows it
+        # skipped, so the inserted ones are read back, with their pks
+        if not addresses:
+            return addresses
+        stored = dict(
+            ((user_id, email, key), pk)
+            for pk, user_id, email, key in self.filter(
+                key__in=[address.key for address in addresses],
+            ).values_list('pk', 'user_id', 'email', 'key')
+        )
+        inserted = []
+        for address in addresses:
+            pk = stored.get((address.user_id, address.email, address.key))
+            if pk is not None:
+                address.pk = pk
+                inserted.append(address)
+        return inserted
+
+    @instrument('manager.bulk_set_primary_emails')
+    def bulk_set_primary_emails(self, pairs, batch_size=None,
+                                require_confirmed=True):
+        """
+        Set the primary email of many Users from an iterable of (user, email)
+        pairs, one batch at a time. Each batch's addresses are checked to be
+        confirmed with one query, unless require_confirmed is False, and
+        written with bulk_update(). Pairs whose address isn't confirmed are
+        skipped, as are ones that change nothing. Sends one
+        primary_emails_changed signal per batch. Returns the list of Users
+        changed.
+        """
+        batch_size = batch_size or getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+        )
+        changed = []
+        for chunk in chunked(pairs, batch_size):
+            changes = self._set_primary_emails_chunk(chunk, require_confirmed)
+            if changes:
+                dispatch.send(
+                    primary_emails_changed,
+                    using=self.db,
+                    sender=get_user_model(),
+                    changes=changes,
+                )
+            changed.extend(user for user, _, _ in changes)
+        return changed
+
+    def _set_primary_emails_chunk(self, pairs, require_confirmed):
+        # returns (user, old_email, new_email) triples, last pair per User
+        user_model = get_user_model()
+        field_name = getattr(user_model, 'primary_email_field_name', 'email')
+        targets = dict((user.pk, (user, email)) for user, email in pairs)
+        targets = dict(
+            (pk, (user, email)) for pk, (user, email) in targets.items()
+            if getattr(user, field_name) != email
+        )
+        if not targets:
+            return []
+
+        if require_confirmed:
+            # filtering on users alone, as in _bulk_create_chunk()
+            confirmed = set(self.model._default_manager.db_manager(
+                self.db,
+            ).confirmed().filter(
+                user__in=list(targets),
+            ).values_list('user_id', 'email'))
+            targets = dict(
+                (pk, (user, email)) for pk, (user, email) in targets.items()
+                if (pk, email) in confirmed
+            )
+
+        changes = []
+        for user, email in targets.values():
+            changes.append((user, getattr(user, field_name), email))
+            setattr(user, field_name, email)
+            if hasattr(user, 'clear_email_address_cache'):
+                user.clear_email_address_cache()
+        users = [user for user, _, _ in changes]
+        user_model._default_manager.db_manager(self.db).bulk_update(
+            users, [field_name],
+        )
+        status_cache.invalidate([user.pk for user in users], using=self.db)
+        return changes
+
+    def purge_expired(self, batch_size=None, sleep=0, start_after=None,
+                      archive=None, include_primary=False):
+        """
+        Delete unconfirmed email addresses whose confirmation key has expired,
+        in batches ordered by primary key.
+
+        After each batch, yields the number of addresses deleted and the last
+        primary key examined; pass that as start_after to resume. If given,
+        archive is called with each batch of addresses before it's deleted.
+        """
+        if get_confirmation_period() is None:
+            return
+        batch_size = batch_size or getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+        )
+        # revocations only matter while the keys they refuse are unexpired
+        SignedKeyRevocation.objects.db_manager(self.db).filter(
+            revoked_at__lte=timezone.now() - get_confirmation_period(),
+        ).delete()
+
+        queryset = self.unconfirmed().expired()
+        if not include_primary:
+            # a User's primary email is only removed on request, as with
+            # SimpleEmailConfirmationUserMixin.remove_email()
+            queryset = queryset.not_primary()
+
+        cursor = start_after
+        while True:
+            batch = queryset.order_by('pk')
+            if cursor is not None:
+                batch = batch.filter(pk__gt=cursor)
+            if archive is None:
+                rows = list(batch.values_list('pk', 'user_id')[:batch_size])
+            else:
+                addresses = list(batch[:batch_size])
+                rows = [(address.pk, address.user_id) for address in addresses]
+            if not rows:
+                return
+            pks = [pk for pk, user_pk in rows]
+
+            if archive is not None:
+                archive(addresses)
+            # rows reset or confirmed since they were read are left alone
+            deleted, _ = queryset.filter(pk__in=pks).delete()
+            status_cache.invalidate(
+                [user_pk for pk, user_pk in rows], using=self.db,
+            )
+            cursor = pks[-1]
+            yield deleted, cursor
+
+            if len(pks) < batch_size:
+                return
+            if sleep:
+                time.sleep(sleep)
+
+    @instrument('manager.confirm', outcome=_confirmed_outcome)
     def confirm(self, key, user=None, save=True):
         "Confirm an email address. Returns the address that was confirmed."
+        if save:
+            address, confirmed = self.confirm_once(key, user=user)
+        else:
+            address = self._get_for_key(key, user)
+            confirmed = False
+            if not address.is_confirmed:
+                address.confirmed_at = timezone.now()
+                address._confirm_outcome = 'unsaved'
+                return address
+        address._confirm_outcome = (
+            'confirmed' if confirmed else 'already_confirmed'
+        )
+        return address
+
+    @instrument('manager.confirm_once', outcome=_confirm_once_outcome)
+    def confirm_once(self, key, user=None):
+        """
+        Confirm an email address with a single conditional UPDATE, so that
+        of several concurrent calls with the same key exactly one confirms
+        it. Returns an (address, confirmed) tuple, where confirmed is True
+        if this call confirmed the address. Without user, the address's User
+        is read with a second query, for the signal.
+        """
+        address, confirmed = self._confirm_once(key, user)
+        if confirmed:
+            status_cache.invalidate([address.user_id], using=self.db)
+            dispatch.send(
+                email_confirmed,
+                using=self.db,
+                sender=address.user.__class__,
+                user=address.user,
+                email=address.email
+            )
+        return address, confirmed
+
+    @instrument('manager.aconfirm', outcome=_confirmed_outcome)
+    async def aconfirm(self, key, user=None, save=True):
+        "Async version of confirm()"
+        if save:
+            address, confirmed = await self.aconfirm_once(key, user=user)
+        else:
+            address = await sync_to_async(self._get_for_key)(key, user)
+            confirmed = False
+            if not address.is_confirmed:
+                address.confirmed_at = timezone.now()
+                address._confirm_outcome = 'unsaved'
+                return address
+        address._confirm_outcome = (
+            'confirmed' if confirmed else 'already_confirmed'
+        )
+        return address
+
+    @instrument('manager.aconfirm_once', outcome=_confirm_once_outcome)
+    async def aconfirm_once(self, key, user=None):
+        "Async version of confirm_once()"
+        def confirm():
+            address, confirmed = self._confirm_once(key, user)
+            if confirmed and not user:
+                # fetched here, for the signal, while queries are allowed
+                address.user
+            return address, confirmed
+
+        address, confirmed = await sync_to_async(confirm)()
+        if confirmed:
+            await status_cache.ainvalidate([address.user_id])
+            await dispatch.asend(
+                email_confirmed,
+                sender=address.user.__class__,
+                user=address.user,
+                email=address.email
+            )
+        return address, confirmed
+
+    @instrument('manager.bulk_confirm')
+    def bulk_confirm(self, keys, batch_size=None):
+        """
+        Confirm the unconfirmed, unexpired email addresses for keys, an
+        iterable of confirmation keys or a queryset of email addresses.
+        Keys are confirmed with one UPDATE per batch, skipping unknown,
+        expired and used ones; a queryset with a single UPDATE. Sends one
+        emails_confirmed signal per batch. Returns the list of addresses
+        confirmed.
+        """
+        now = timezone.now()
+        if isinstance(keys, models.QuerySet):
+            batches = [keys.unconfirmed().unexpired()]
+        else:
+            batch_size = batch_size or getattr(
+                settings, 'SIMPLE_EMAIL_CONFIRMATION_BULK_BATCH_SIZE', 1000
+            )
+            batches = chunked(keys, batch_size)
+
+        confirmed = []
+        for batch in batches:
+            if isinstance(batch, models.QuerySet):
+                addresses = self._set_all_confirmed_at(batch, now)
+            elif get_key_mode() == 'signed':
+                addresses = self._bulk_confirm_signed(batch, now)
+            else:
+                pending = self.unconfirmed().unexpired().filter(
+                    key__in=self._stored_keys(batch),
+                )
+                addresses = self._set_all_confirmed_at(pending, now)
+            if addresses:
+                status_cache.invalidate(
+                    [address.user_id for address in addresses],
+                    using=addresses[0]._state.db,
+                )
+                dispatch.send(
+                    emails_confirmed,
+                    using=addresses[0]._state.db,
+                    sender=get_user_model(),
+                    addresses=addresses,
+                )
+            confirmed.extend(addresses)
+        return confirmed
+
+    @instrument('manager.bulk_confirm_domain')
+    def bulk_confirm_domain(self, domain):
+        """
+        Confirm the unconfirmed, unexpired email addresses at domain, e.g.
+        once an identity provider vouches for it, with bulk_confirm().
+        Subdomains aren't included. Returns the list of addresses confirmed.
+        """
+        return self.bulk_confirm(
+            self.filter(email__iendswith='@' + domain.lstrip('@')),
+        )
+
+    def _stored_keys(self, keys):
+        # the values any of keys may be stored as
+        stored = []
+        for key in keys:
+            lookup = self._key_lookup(key)
+            stored.extend(lookup.get('key__in') or [lookup['key']])
+        return stored
+
+    def _set_all_confirmed_at(self, pending, now):
+        # returns the addresses updated
+        if _can_update_returning(connections[pending.db]):
+            return _update_returning_all(pending, {'confirmed_at': now})
+        pks = list(pending.values_list('pk', flat=True))
+        if not pks:
+            return []
+        manager = self.model._default_manager.db_manager(pending.db)
+        manager.filter(
+            pk__in=pks, confirmed_at__isnull=True,
+        ).update(confirmed_at=now)
+        # rows confirmed by someone else meanwhile have another confirmed_at
+        return list(manager.filter(pk__in=pks, confirmed_at=now))
+
+    def _bulk_confirm_signed(self, keys, now):
+        # unconfirmed addresses are only stored after a reset, so most of
+        # the addresses are inserted rather than updated
+        loaded = {}
+        for key in keys:
+            try:
+                user_pk, email, set_at, issued_at = self._load_signed_key(key)
+            except (self.model.DoesNotExist, EmailConfirmationExpired):
+                continue
+            loaded.setdefault((user_pk, email), []).append((set_at, issued_at))
+        if not loaded:
+            return []
+
+        user_pks = set(user_pk for user_pk, _ in loaded)
+        stored = dict(
+            ((user_id, email), (pk, set_at, confirmed_at))
+            for pk, user_id, email, set_at, confirmed_at in self.filter(
+                user__in=user_pks,
+            ).values_list('pk', 'user_id', 'email', 'set_at', 'confirmed_at')
+        )
+        revocations = SignedKeyRevocation.objects.filter(user__in=user_pks)
+        revoked = dict(
+            ((user_id, email), revoked_at)
+            for user_id, email, revoked_at in revocations.values_list(
+                'user_id', 'email', 'revoked_at',
+            )
+        )
+        pending = []
+        new_pairs = []
+        for pair, states in loaded.items():
+            if pair in stored:
+                pk, stored_set_at, confirmed_at = stored[pair]
+                if confirmed_at is None and any(
+                    set_at == stored_set_at for set_at, _ in states
+                ):
+                    pending.append(pk)
+            elif any(
+                set_at is None and
+                _key_not_revoked(issued_at, revoked.get(pair))
+                for set_at, issued_at in states
+            ):
+                new_pairs.append(pair)
+
+        addresses = []
+        if pending:
+            addresses = self._set_all_confirmed_at(
+                self.unconfirmed().filter(pk__in=pending), now,
+            )
+
+        created = [
+            self.model(
+                user_id=user_pk, email=email, key=key,
+                set_at=now, confirmed_at=now,
+            )
+            for (user_pk, email), key in zip(
+                new_pairs, self.generate_unused_keys(len(new_pairs)),
+            )
+        ]
+        # as with bulk creation, a concurrent insert of an address wins
+        self.bulk_create(created, ignore_conflicts=True)
+        return addresses + self._stored_only(created)
+
+    def _confirm_once(self, key, user):
+        # confirm_once() without the signal
+        queryset = self.all()
+        if user:
+            queryset = queryset.filter(user=user)
+
+        now = timezone.now()
+        if get_key_mode() == 'signed':
+            address, confirmed = self._confirm_signed(key, user, now)
+        else:
+            lookup = self._key_lookup(key)
+            address = self._set_confirmed_at(
+                queryset.unconfirmed().unexpired(), lookup, user, now,
+            )
+            confirmed = address is not None
+            if not confirmed:
+                # the key is unknown, expired or has already been used
+                address = self._get_for_key(key, user)
+
+        if confirmed and user:
+            address.user = user
+        return address, confirmed
+
+    def _set_confirmed_at(self, queryset, lookup, user, now):
+        # returns the address updated, or None
+        pending = queryset.filter(**lookup)
+        if _can_update_returning(connections[pending.db]):
+            return _update_returning(pending, {'confirmed_at': now})
+        if not pending.update(confirmed_at=now):
+            return None
+        queryset = self.all()
+        if not user:
+            queryset = queryset.select_related('user')
+        return queryset.get(**lookup)
+
+    def _confirm_signed(self, key, user, now):
+        user_pk, email, set_at, issued_at = self._load_signed_key(key, user)
+        lookup = {'user': user_pk, 'email': email}
+        if set_at is not None:
+            # the address was stored when the key was made, e.g. by a reset
+            address = self._set_confirmed_at(
+                self.unconfirmed(), dict(lookup, set_at=set_at), user, now,
+            )
+            if address is not None:
+                return address, True
+
+        address = self._get_signed_address(user_pk, email, set_at, issued_at)
+        if address is not None:
+            return address, False
+
+        # the address was never written, or is already confirmed
+        for attempt in range(1, KEY_ATTEMPTS + 1):
+            address = self.model(
+                user_id=user_pk, email=email, key=self.generate_key(),
+                set_at=now, confirmed_at=now,
+            )
+            try:
+                with transaction.atomic(using=self.db):
+                    address.save(force_insert=True, using=self.db)
+            except IntegrityError:
+                try:
+                    return self.get(**lookup), False
+                except self.model.DoesNotExist:
+                    # the key collided, rather than the address
+                    if attempt == KEY_ATTEMPTS:
+                        raise IntegrityError('No unused key was generated')
+                    metrics.incr('key.collisions')
+            else:
+                return address, True
+
+    def _get_for_key(self, key, user=None):
+        if get_key_mode() == 'signed':
+            loaded = self._load_signed_key(key, user)
+            address = self._get_signed_address(*loaded)
+            if address is None:
+                user_pk, email = loaded[:2]
+                return self.model(user_id=user_pk, email=email, key='')
+            return address
+
         queryset = self.all()
         if user:
             queryset = queryset.filter(user=user)
-        address = queryset.get(key=key)
+        lookup = self._key_lookup(key)
+        try:
+            return queryset.unexpired().get(**lookup)
+        except self.model.DoesNotExist:
+            # only a failed lookup pays for telling the two apart
+            if queryset.filter(**lookup).exists():
+                raise EmailConfirmationExpired()
+            raise
+
+    def make_signed_key(self, user_pk, email, set_at=None):
+        """
+        A confirmation key for a User's email, as used in signed key mode.
+        If the address is stored, set_at is when its key was last set; the
+        key stops working once that changes.
+        """
+        return signing.dumps(
+            [
+                str(user_pk), email, _dump_key_time(set_at),
+                _dump_key_time(timezone.now()),
+            ],
+            salt=SIGNED_KEY_SALT, compress=True,
+        )
 
-        if address.is_key_expired:
+    def _load_signed_key(self, key, user=None):
+        # returns the user pk, email, stored set_at and time the key was made
+        # with; keys made before they carried the last two have neither
+        period = get_confirmation_period()
+        try:
+            payload = signing.loads(
+                key, salt=SIGNED_KEY_SALT,
+                max_age=period.total_seconds() if period is not None else None,
+            )
+            user_pk, email = payload[:2]
+            set_at, issued_at = (list(payload[2:4]) + [None, None])[:2]
+            set_at = _load_key_time(set_at)
+            issued_at = _load_key_time(issued_at)
+        except signing.SignatureExpired:
             raise EmailConfirmationExpired()
+        except (signing.BadSignature, TypeError, ValueError):
+            raise self.model.DoesNotExist(
+                'Email address matching query does not exist.'
+            )
+        user_model = self.model._meta.get_field('user').related_model
+        user_pk = user_model._meta.pk.to_python(user_pk)
+        if user and user.pk != user_pk:
+            raise self.model.DoesNotExist(
+                'Email address matching query does not exist.'
+            )
+        return user_pk, email, set_at, issued_at
 
-        if not address.is_confirmed:
-            address.confirmed_at = timezone.now()
-            if save:
-                address.save(update_fields=['confirmed_at'])
-                email_confirmed.send(
-                    sender=address.user.__class__,
-                    user=address.user,
-                    email=address.email
-                )
+    def _get_signed_address(self, user_pk, email, set_at, issued_at):
+        # the stored address a signed key is for, or None if there's none;
+        # raises if it was removed or its key reset since the key was made
+        try:
+            address = self.get(user=user_pk, email=email)
+        except self.model.DoesNotExist:
+            revoked_at = SignedKeyRevocation.objects.filter(
+                user=user_pk, email=email,
+            ).values_list('revoked_at', flat=True).first()
+            if set_at is None and _key_not_revoked(issued_at, revoked_at):
+                return None
+        else:
+            if address.is_confirmed or address.set_at == set_at:
+                return address
+        raise self.model.DoesNotExist(
+            'Email address matching query does not exist.'
+        )
 
-        return address
+    def revoke_signed_keys(self, pairs):
+        """
+        In signed key mode, refuse the keys made so far for the addresses of
+        (user pk, email) pairs that aren't stored, e.g. once removed
+        """
+        if get_key_mode() != 'signed':
+            return
+        now = timezone.now()
+        for user_pk, email in pairs:
+            SignedKeyRevocation.objects.update_or_create(
+                user_id=user_pk, email=email, defaults={'revoked_at': now},
+            )
 
 
 def get_user_primary_email(user):
@@ -251,8 +1492,28 @@ class AbstractEmailAddress(models.Model):
 
     objects = EmailAddressManager()
 
+    # the confirmation key as generated, set on addresses created or reset
+    # in this process. Unlike key, it's usable in hashed key mode too.
+    raw_key = None
+
     class Meta:
         unique_together = (('user', 'email'),)
+        indexes = [
+            # lookups by email alone, ex: duplicate checks and admin search.
+            # On PostgreSQL, the pattern operator class lets prefix searches
+            # use it under any collation; equality still can.
+            models.Index(
+                fields=['email'], name='sec_%(class)s_email',
+                opclasses=['varchar_pattern_ops'],
+            ),
+            # case-insensitive lookups, on backends with expression indexes
+            models.Index(Upper('email'), name='sec_%(class)s_email_ci'),
+            # expiry sweeps, on backends with partial indexes
+            models.Index(
+                fields=['set_at'], name='sec_%(class)s_pending',
+                condition=Q(confirmed_at__isnull=True),
+            ),
+        ]
         verbose_name_plural = "email addresses"
         abstract = True
 
@@ -270,29 +1531,118 @@ class AbstractEmailAddress(models.Model):
 
     @property
     def key_expires_at(self):
-        # By default, keys don't expire. If you want them to, set
-        # settings.SIMPLE_EMAIL_CONFIRMATION_PERIOD to a timedelta.
-        period = getattr(
-            settings, 'SIMPLE_EMAIL_CONFIRMATION_PERIOD', None
-        )
+        period = get_confirmation_period()
         return self.set_at + period if period is not None else None
 
     @property
     def is_key_expired(self):
         return self.key_expires_at and timezone.now() >= self.key_expires_at
 
-    def reset_confirmation(self):
+    def _get_cooldown_key(self):
+        # the current key, if it was set too recently to be replaced
+        mode = get_key_mode()
+        if mode == 'signed' or not throttling.in_cooldown(self):
+            # signed keys are replaced without a write
+            return None
+        metrics.incr('resend.suppressed')
+        if self.raw_key is None:
+            if mode == 'hashed':
+                # the current key can't be recovered from its digest
+                raise EmailConfirmationThrottled()
+            self.raw_key = self.key
+        return self.raw_key
+
+    def _save_new_key(self, manager):
+        # the key is the only unique column written, so an IntegrityError
+        # means it collided with a stored one
+        using = router.db_for_write(self.__class__, instance=self)
+        for attempt in range(1, KEY_ATTEMPTS + 1):
+            self.raw_key = manager.generate_key()
+            self.key = manager.get_stored_key(self.raw_key)
+            try:
+                with _key_savepoint(using):
+                    self.save(
+                        update_fields=['key', 'set_at', 'confirmed_at'],
+                        using=using,
+                    )
+            except IntegrityError:
+                if attempt == KEY_ATTEMPTS:
+                    raise
+                metrics.incr('key.collisions')
+            else:
+                return
+
+    def reset_confirmation(self, force=False):
         """
         Re-generate the confirmation key and key expiration associated
         with this email.  Note that the previous confirmation key will
-        cease to work.
+        cease to work, except in signed key mode, where it keeps working
+        until it expires.
+
+        Unless force is given, the resend cooldown and rate limit in
+        simple_email_confirmation.throttling are applied first.
         """
-        self.key = get_email_address_model()._default_manager.generate_key()
+        if not force:
+            throttling.check_rate(self)
+            key = self._get_cooldown_key()
+            if key is not None:
+                return key
+
+        manager = get_email_address_model()._default_manager
+        if get_key_mode() == 'signed':
+            # earlier keys are refused once a stored address's set_at
+            # changes, or an unstored one's keys are revoked
+            if self.pk is None:
+                manager.revoke_signed_keys([(self.user_id, self.email)])
+            else:
+                self.set_at = timezone.now()
+                self.confirmed_at = None
+                self.save(update_fields=['set_at', 'confirmed_at'])
+                status_cache.invalidate_saved(
+                    [self.user_id], using=self._state.db,
+                )
+            self.raw_key = manager.make_signed_key(
+                self.user_id, self.email,
+                self.set_at if self.pk is not None else None,
+            )
+            return self.raw_key
+
         self.set_at = timezone.now()
+        self.confirmed_at = None
+        self._save_new_key(manager)
+        status_cache.invalidate_saved([self.user_id], using=self._state.db)
+        return self.raw_key
 
+    async def areset_confirmation(self, force=False):
+        "Async version of reset_confirmation()"
+        if not force:
+            await throttling.acheck_rate(self)
+            key = self._get_cooldown_key()
+            if key is not None:
+                return key
+
+        manager = get_email_address_model()._default_manager
+        if get_key_mode() == 'signed':
+            if self.pk is None:
+                await sync_to_async(manager.revoke_signed_keys)(
+                    [(self.user_id, self.email)],
+                )
+            else:
+                self.set_at = timezone.now()
+                self.confirmed_at = None
+                await self.asave(update_fields=['set_at', 'confirmed_at'])
+                await status_cache.ainvalidate_saved([self.user_id])
+            self.raw_key = manager.make_signed_key(
+                self.user_id, self.email,
+                self.set_at if self.pk is not None else None,
+            )
+            return self.raw_key
+
+        self.set_at = timezone.now()
         self.confirmed_at = None
-        self.save(update_fields=['key', 'set_at', 'confirmed_at'])
-        return self.key
+        await sync_to_async(self._save_new_key)(manager)
+        await status_cache.ainvalidate_saved([self.user_id])
+        return self.raw_key
 
 
 class EmailAddress(AbstractEmailAddress):
@@ -300,19 +1650,85 @@ class EmailAddress(AbstractEmailAddress):
         swappable = 'SIMPLE_EMAIL_CONFIRMATION_EMAIL_ADDRESS_MODEL'
 
 
-# by default, auto-add unconfirmed EmailAddress objects for new Users
-if getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_AUTO_ADD', True):
-    def auto_add(sender, **kwargs):
-        if sender == get_user_model() and kwargs['created'] and not kwargs['raw']:
-            user = kwargs.get('instance')
-            email = get_user_primary_email(user)
-            if email:
-                if hasattr(user, 'add_unconfirmed_email'):
-                    user.add_unconfirmed_email(email)
-                else:
-                    user.email_address_set.create_unconfirmed(email)
+class SignedKeyRevocation(models.Model):
+    """
+    When the signed confirmation keys made so far for a User's email were
+    revoked, in signed key mode, while the address isn't stored
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE,
+    )
+    email = models.EmailField(max_length=255)
+    revoked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (('user', 'email'),)
+
+
+# the (user, email) pairs collected by defer_auto_add(), or None. A context
+# variable is seen from the thread asgiref runs async ORM calls in.
+_auto_add_pending = ContextVar(
+    'simple_email_confirmation_auto_add_pending', default=None,
+)
+
 
-    # TODO: try to only connect this to the User model. We can't use
-    #       get_user_model() here - results in import loop.
+def auto_add(sender, **kwargs):
+    """
+    Add an unconfirmed EmailAddress for a new User's primary email.
+    Connected to post_save of the User model unless
+    settings.SIMPLE_EMAIL_CONFIRMATION_AUTO_ADD is False.
+    """
+    if kwargs['created'] and not kwargs['raw']:
+        user = kwargs.get('instance')
+        email = get_user_primary_email(user)
+        if email:
+            pending = _auto_add_pending.get()
+            if pending is not None:
+                pending.append((user, email))
+            elif hasattr(user, 'add_unconfirmed_email'):
+                user.add_unconfirmed_email(email)
+            else:
+                user.email_address_set.create_unconfirmed(email)
 
-    post_save.connect(auto_add)
+
+@contextmanager
+def defer_auto_add(batch_size=None):
+    """
+    Collect the addresses auto-added for Users created inside the block and
+    insert them with bulk_create_unconfirmed() when it exits. If the block
+    raises, nothing is inserted.
+    """
+    if _auto_add_pending.get() is not None:
+        # already deferred by an enclosing block, which will insert them
+        yield
+        return
+
+    token = _auto_add_pending.set([])
+    try:
+        yield
+        pending = _auto_add_pending.get()
+    finally:
+        _auto_add_pending.reset(token)
+    get_email_address_model()._default_manager.bulk_create_unconfirmed(
+        pending, batch_size=batch_size,
+    )
+
+
+@asynccontextmanager
+async def adefer_auto_add(batch_size=None):
+    "Async version of defer_auto_add()"
+    if _auto_add_pending.get() is not None:
+        yield
+        return
+
+    token = _auto_add_pending.set([])
+    try:
+        yield
+        pending = _auto_add_pending.get()
+    finally:
+        _auto_add_pending.reset(token)
+    manager = get_email_address_model()._default_manager
+    await sync_to_async(manager.bulk_create_unconfirmed)(
+        pending, batch_size=batch_size,
+    )
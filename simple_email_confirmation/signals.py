@@ -1,16 +1,16 @@
-import django
 from django.dispatch import Signal
 
-if django.VERSION < (4, 0):
-
-    email_confirmed = Signal(providing_args=['user', 'email'])
-    unconfirmed_email_created = Signal(providing_args=['user', 'email'])
-    primary_email_changed = Signal(
-        providing_args=['user', 'old_email', 'new_email'],
-    )
-
-else:
-
-    email_confirmed = Signal()
-    unconfirmed_email_created = Signal()
-    primary_email_changed = Signal()
+# sent with user and email
+email_confirmed = Signal()
+# sent with user, email and key
+unconfirmed_email_created = Signal()
+# sent with user, old_email and new_email
+primary_email_changed = Signal()
+# sent with addresses, one batch of those created
+unconfirmed_emails_created = Signal()
+# sent with addresses, one batch of those confirmed
+emails_confirmed = Signal()
+# sent with changes, one batch of (user, old_email, new_email) triples
+primary_emails_changed = Signal()
+# sent with measurement, by the send_measurement_signal instrumentation sink
+operation_measured = Signal()
@@ -1,15 +1,26 @@
 import uuid
 
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as BaseUserManager
 from django.db import models
 
-from simple_email_confirmation.models import SimpleEmailConfirmationUserMixin
+from simple_email_confirmation.models import (
+    SimpleEmailConfirmationUserMixin, SimpleEmailConfirmationUserQuerySetMixin,
+)
 
 
-class User(SimpleEmailConfirmationUserMixin, AbstractUser):
+class UserQuerySet(SimpleEmailConfirmationUserQuerySetMixin, models.QuerySet):
+    pass
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     pass
 
 
+class User(SimpleEmailConfirmationUserMixin, AbstractUser):
+    objects = UserManager()
+
+
 class UserWithoutMixin(models.Model):
     email = models.EmailField()
 
@@ -35,7 +35,7 @@ INSTALLED_APPS = (
     'simple_email_confirmation.tests.myproject.myapp',
 )
 
-MIDDLEWARE_CLASSES = (
+MIDDLEWARE = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -44,6 +44,20 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
 
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
 ROOT_URLCONF = 'simple_email_confirmation.tests.myproject.urls'
 
 WSGI_APPLICATION = 'project.wsgi.application'
@@ -78,6 +92,9 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
 # Custom user model
 AUTH_USER_MODEL = 'myapp.User'
 
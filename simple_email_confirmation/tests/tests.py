@@ -1,19 +1,49 @@
 from datetime import timedelta
-from time import sleep
+import csv
+import json
+import os
+import tempfile
+import threading
+from time import perf_counter, sleep
+from unittest import mock, skipUnless
+
+from asgiref.sync import SyncToAsync
+from six import StringIO
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core import mail as django_mail
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
 from ..exceptions import (
-    EmailConfirmationExpired, EmailIsPrimary, EmailNotConfirmed,
+    EmailConfirmationExpired, EmailConfirmationKeyNotStored,
+    EmailConfirmationThrottled, EmailIsPrimary, EmailNotConfirmed,
 )
 from simple_email_confirmation import get_email_address_model
-from ..models import EmailAddress, get_user_primary_email
+from .. import (
+    benchmarks, dispatch, export, mail, metrics, throttling,
+)
+from ..admin import EstimatedCountPaginator
+from ..middleware import EmailConfirmationStatusMiddleware
+from ..models import (
+    KEY_ALPHABET, KEY_ATTEMPTS, EmailAddress, SignedKeyRevocation,
+    adefer_auto_add, defer_auto_add, get_user_primary_email, hash_key,
+    random_keys,
+)
 from ..signals import (
-    email_confirmed, unconfirmed_email_created, primary_email_changed,
+    email_confirmed, emails_confirmed, operation_measured,
+    unconfirmed_email_created, primary_email_changed,
+    primary_emails_changed, unconfirmed_emails_created,
 )
 
 from .myproject.myapp.models import CustomEmailAddress
@@ -248,6 +278,77 @@ class PrimaryEmailTestCase(TestCase):
         self.assertEqual('%s' % email_obj, '%s <%s>' % (self.user, self.user.email))
 
 
+class BulkSetPrimaryEmailsTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(
+                'user{}'.format(i), email='user{}@old.example'.format(i),
+            )
+            for i in range(5)
+        ]
+        EmailAddress.objects.bulk_create_confirmed(
+            (user, 'user{}@new.example'.format(i))
+            for i, user in enumerate(self.users[:4])
+        )
+        self.batches = []
+
+        def listener(sender, changes, **kwargs):
+            self.batches.append(changes)
+        primary_emails_changed.connect(listener)
+        self.addCleanup(primary_emails_changed.disconnect, listener)
+
+    def pairs(self):
+        return [
+            (user, 'user{}@new.example'.format(i))
+            for i, user in enumerate(self.users)
+        ]
+
+    def primary_emails(self):
+        return list(get_user_model().objects.order_by('pk').values_list(
+            'email', flat=True,
+        ))
+
+    def test_bulk_set_primary_emails(self):
+        self.users[0].is_confirmed  # loads the User's addresses
+        with CaptureQueriesContext(connection) as queries:
+            changed = EmailAddress.objects.bulk_set_primary_emails(
+                self.pairs(), batch_size=3,
+            )
+
+        # a confirmation check and an update per batch
+        self.assertEqual(len([
+            query for query in queries
+            if 'SAVEPOINT' not in query['sql']
+        ]), 4)
+        # the last User's new address isn't confirmed
+        self.assertEqual(changed, self.users[:4])
+        self.assertEqual(self.primary_emails(), [
+            'user0@new.example', 'user1@new.example', 'user2@new.example',
+            'user3@new.example', 'user4@old.example',
+        ])
+        self.assertEqual([len(batch) for batch in self.batches], [3, 1])
+        user, old_email, new_email = self.batches[0][0]
+        self.assertEqual(user, self.users[0])
+        self.assertEqual(old_email, 'user0@old.example')
+        self.assertEqual(new_email, 'user0@new.example')
+        self.assertTrue(self.users[0].is_confirmed)
+
+    def test_bulk_set_primary_emails_skips_unchanged(self):
+        pairs = [(user, user.email) for user in self.users]
+        with self.assertNumQueries(0):
+            changed = EmailAddress.objects.bulk_set_primary_emails(pairs)
+        self.assertEqual(changed, [])
+        self.assertEqual(self.batches, [])
+
+    def test_bulk_set_primary_emails_unconfirmed(self):
+        changed = EmailAddress.objects.bulk_set_primary_emails(
+            self.pairs(), require_confirmed=False,
+        )
+        self.assertEqual(changed, self.users)
+        self.assertEqual(self.primary_emails()[4], 'user4@new.example')
+
+
 class AddEmailIfNotExistsTestCase(TestCase):
 
     def setUp(self):
@@ -321,6 +422,70 @@ class AutoAddTestCase(TestCase):
         self.assertFalse(user.is_confirmed)
 
 
+class DeferAutoAddTestCase(TestCase):
+
+    def test_receiver_scoped_to_user_model(self):
+        self.assertTrue(post_save.has_listeners(get_user_model()))
+        self.assertFalse(
+            post_save.has_listeners(apps.get_model('myapp', 'UserWithoutMixin'))
+        )
+
+    def test_defer_auto_add(self):
+        batches = []
+
+        def listener(sender, addresses, **kwargs):
+            batches.append(addresses)
+        unconfirmed_emails_created.connect(listener)
+        self.addCleanup(unconfirmed_emails_created.disconnect, listener)
+
+        with CaptureQueriesContext(connection) as queries:
+            with defer_auto_add(batch_size=10):
+                with defer_auto_add():
+                    users = [
+                        get_user_model().objects.create_user(
+                            'user{}'.format(i), email='user{}@t.t'.format(i),
+                        )
+                        for i in range(20)
+                    ]
+                self.assertEqual(EmailAddress.objects.count(), 0)
+
+        # an insert per user, the count above, then an existence check, a
+        # key check, an insert and a read back per batch
+        self.assertEqual(len(queries), 20 + 1 + 8)
+        self.assertEqual([len(batch) for batch in batches], [10, 10])
+        for user in users:
+            self.assertEqual(user.get_unconfirmed_emails(), [user.email])
+
+    def test_defer_auto_add_discards_on_error(self):
+        with self.assertRaises(ValueError):
+            with defer_auto_add():
+                get_user_model().objects.create_user('uname', email='u@t.t')
+                raise ValueError()
+        self.assertEqual(EmailAddress.objects.count(), 0)
+
+        get_user_model().objects.create_user('after', email='a@t.t')
+        self.assertEqual(EmailAddress.objects.count(), 1)
+
+    async def test_adefer_auto_add(self):
+        async def create(i):
+            await get_user_model().objects.acreate(
+                username='user{}'.format(i), email='user{}@t.t'.format(i),
+            )
+
+        async with adefer_auto_add():
+            # the User is saved in another thread, which sees the deferral
+            await create(0)
+            self.assertEqual(await EmailAddress.objects.acount(), 0)
+        # outside the block, addresses are added as Users are created
+        await create(1)
+        self.assertEqual(
+            sorted([email async for email in EmailAddress.objects.values_list(
+                'email', flat=True,
+            )]),
+            ['user0@t.t', 'user1@t.t'],
+        )
+
+
 class EmailAddressModelTestCase(TestCase):
     """
     Test the get_email_address_model method.
@@ -347,3 +512,1958 @@ class EmailAddressModelTestCase(TestCase):
             EmailAddress),
             type(self.user.email_address_set.get(email=self.test_email))
         )
+
+
+class BulkCreateTestCase(TestCase):
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user('user{}'.format(i))
+            for i in range(10)
+        ]
+
+    def test_bulk_create_unconfirmed(self):
+        pairs = [(user, '{}@t.t'.format(user.username)) for user in self.users]
+
+        batches = []
+
+        def listener(sender, addresses, **kwargs):
+            self.assertEqual(sender, get_user_model())
+            batches.append(addresses)
+        unconfirmed_emails_created.connect(listener)
+        self.addCleanup(unconfirmed_emails_created.disconnect, listener)
+
+        addresses = EmailAddress.objects.bulk_create_unconfirmed(
+            pairs, batch_size=4,
+        )
+
+        self.assertEqual(len(addresses), 10)
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        for user, email in pairs:
+            address = user.email_address_set.get(email=email)
+            self.assertFalse(address.is_confirmed)
+        keys = EmailAddress.objects.values_list('key', flat=True)
+        self.assertEqual(len(set(keys)), 10)
+
+    def test_bulk_create_confirmed(self):
+        pairs = [(user, '{}@t.t'.format(user.username)) for user in self.users]
+
+        addresses = EmailAddress.objects.bulk_create_confirmed(pairs)
+
+        self.assertEqual(len(addresses), 10)
+        for user, email in pairs:
+            self.assertEqual(user.get_confirmed_emails(), [email])
+
+    def test_bulk_create_skips_existing(self):
+        user = self.users[0]
+        user.add_confirmed_email('a@t.t')
+        pairs = [(user, 'a@t.t'), (user, 'b@t.t'), (user, 'b@t.t')]
+
+        addresses = EmailAddress.objects.bulk_create_unconfirmed(pairs)
+
+        self.assertEqual([a.email for a in addresses], ['b@t.t'])
+        self.assertEqual(user.get_confirmed_emails(), ['a@t.t'])
+        self.assertEqual(user.get_unconfirmed_emails(), ['b@t.t'])
+
+    def test_bulk_create_skips_concurrent_inserts(self):
+        user = self.users[0]
+        manager = EmailAddress.objects
+        generate_unused_keys = manager.generate_unused_keys
+
+        def insert_first(count):
+            # another request adds a@t.t after the existence check
+            user.email_address_set.create(email='a@t.t', key='concurrent')
+            return generate_unused_keys(count)
+
+        batches = []
+
+        def listener(sender, addresses, **kwargs):
+            batches.append([address.email for address in addresses])
+        unconfirmed_emails_created.connect(listener)
+        self.addCleanup(unconfirmed_emails_created.disconnect, listener)
+
+        with mock.patch.object(
+            manager, 'generate_unused_keys', side_effect=insert_first,
+        ):
+            addresses = manager.bulk_create_unconfirmed(
+                [(user, 'a@t.t'), (user, 'b@t.t')],
+            )
+
+        self.assertEqual([a.email for a in addresses], ['b@t.t'])
+        self.assertEqual(batches, [['b@t.t']])
+        self.assertEqual(
+            addresses[0].pk, user.email_address_set.get(email='b@t.t').pk,
+        )
+
+    def test_benchmark_per_row_vs_batched(self):
+        "Batched creation beats per-row creation on round trips and time"
+        count = 200
+        users = [
+            get_user_model().objects.create_user('bench{}'.format(i))
+            for i in range(count)
+        ]
+
+        start = perf_counter()
+        with CaptureQueriesContext(connection) as per_row_queries:
+            for user in users:
+                user.add_unconfirmed_email('per-row@t.t')
+        per_row_rate = count / (perf_counter() - start)
+
+        start = perf_counter()
+        with CaptureQueriesContext(connection) as batched_queries:
+            EmailAddress.objects.bulk_create_unconfirmed(
+                [(user, 'batched@t.t') for user in users], batch_size=100,
+            )
+        batched_rate = count / (perf_counter() - start)
+
+        # each insert is wrapped in a savepoint, as the test runs in a
+        # transaction
+        self.assertEqual(len(per_row_queries), count * 3)
+        # one existence check, one key check, one insert and one read back
+        # per batch
+        self.assertEqual(len(batched_queries), 8)
+        self.assertGreater(batched_rate, per_row_rate)
+
+
+class KeyGenerationTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('uname')
+        self.taken = self.user.add_unconfirmed_email('taken@t.t')
+        metrics.reset_counters()
+        self.addCleanup(metrics.reset_counters)
+
+    def patch_keys(self, *keys):
+        "Make key generation return keys, one per call"
+        return mock.patch(
+            'simple_email_confirmation.models.random_keys',
+            side_effect=[[key] for key in keys],
+        )
+
+    def test_random_keys(self):
+        keys = random_keys(1000, 12)
+        self.assertEqual(len(set(keys)), 1000)
+        self.assertTrue(all(len(key) == 12 for key in keys))
+        self.assertEqual(set(''.join(keys)) - set(KEY_ALPHABET), set())
+        # every character of the alphabet turns up
+        self.assertEqual(set(''.join(keys)), set(KEY_ALPHABET))
+
+    def test_create_retries_key_collision(self):
+        with self.patch_keys(self.taken, 'fresh'):
+            key = self.user.add_unconfirmed_email('new@t.t')
+
+        self.assertEqual(key, 'fresh')
+        self.assertEqual(self.user.get_confirmation_key('new@t.t'), 'fresh')
+        self.assertEqual(metrics.get_counters()['key.collisions'], 1)
+
+    def test_create_gives_up_after_attempts(self):
+        keys = [self.taken] * KEY_ATTEMPTS
+        with self.patch_keys(*keys), self.assertRaises(IntegrityError):
+            self.user.add_confirmed_email('new@t.t')
+        # the failed inserts didn't spoil the transaction
+        self.assertEqual(self.user.get_confirmed_emails(), [])
+
+    def test_create_duplicate_address_raises(self):
+        with self.patch_keys('fresh', 'other'):
+            with self.assertRaises(IntegrityError):
+                EmailAddress.objects.create_unconfirmed('taken@t.t', self.user)
+        self.assertNotIn('key.collisions', metrics.get_counters())
+
+    def test_reset_retries_key_collision(self):
+        address = self.user.email_address_set.create_unconfirmed('b@t.t')
+        with self.patch_keys(self.taken, 'fresh'):
+            key = address.reset_confirmation(force=True)
+        self.assertEqual(key, 'fresh')
+        address.refresh_from_db()
+        self.assertEqual(address.key, 'fresh')
+
+    def test_bulk_create_replaces_taken_keys(self):
+        users = [
+            get_user_model().objects.create_user('user{}'.format(i))
+            for i in range(3)
+        ]
+        generated = mock.patch(
+            'simple_email_confirmation.models.random_keys',
+            side_effect=[[self.taken, 'a', 'a'], ['b', 'c']],
+        )
+        with generated:
+            addresses = EmailAddress.objects.bulk_create_confirmed(
+                (user, 'bulk@t.t') for user in users
+            )
+
+        self.assertEqual(
+            sorted(address.raw_key for address in addresses), ['a', 'b', 'c'],
+        )
+        self.assertEqual(
+            EmailAddress.objects.filter(email='bulk@t.t').count(), 3,
+        )
+        self.assertEqual(metrics.get_counters()['key.collisions'], 2)
+
+    def test_collision_report(self):
+        report = benchmarks.key_collision_report(length=4, table_sizes=(1000,))
+        self.assertEqual(report['keyspace'], 62 ** 4)
+        odds = report['stored_keys']['1000']
+        self.assertAlmostEqual(odds['new_key'], 1000 / 62.0 ** 4)
+        # the birthday bound: 1 - exp(-n(n - 1) / 2N)
+        self.assertAlmostEqual(odds['any_pair'], 0.0332, places=4)
+
+    def test_benchmark_keys(self):
+        results = benchmarks.benchmark_keys(count=100)
+        self.assertEqual(results['keys'], 100)
+        self.assertGreater(results['batched_keys_per_sec'], 0)
+
+
+class EmailAddressSnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='nobody@important.com',
+        )
+        self.user.add_confirmed_email('confirmed@t.t')
+        self.user.add_unconfirmed_email('unconfirmed@t.t')
+        self.user = get_user_model().objects.get(pk=self.user.pk)
+
+    def test_status_lookups_share_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertFalse(self.user.is_confirmed)
+            self.assertIsNone(self.user.confirmed_at)
+            self.assertTrue(self.user.get_confirmation_key())
+            self.assertEqual(
+                self.user.get_confirmed_emails(), ['confirmed@t.t'],
+            )
+            self.assertEqual(
+                sorted(self.user.get_unconfirmed_emails()),
+                ['nobody@important.com', 'unconfirmed@t.t'],
+            )
+
+    def test_missing_address_raises(self):
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.get_confirmation_key('missing@t.t')
+
+    def test_mutations_clear_snapshot(self):
+        self.assertFalse(self.user.is_confirmed)
+        self.user.confirm_email(self.user.get_confirmation_key())
+        self.assertTrue(self.user.is_confirmed)
+
+        self.user.add_unconfirmed_email('new@t.t')
+        self.assertIn('new@t.t', self.user.get_unconfirmed_emails())
+
+        self.user.remove_email('new@t.t')
+        self.assertNotIn('new@t.t', self.user.get_unconfirmed_emails())
+
+        self.user.set_primary_email('confirmed@t.t')
+        self.assertTrue(self.user.is_confirmed)
+
+    def test_refresh_from_db_clears_snapshot(self):
+        self.assertFalse(self.user.is_confirmed)
+        EmailAddress.objects.filter(user=self.user).update(
+            confirmed_at=timezone.now(),
+        )
+        self.assertFalse(self.user.is_confirmed)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_confirmed)
+
+
+class PrefetchTestCase(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.bulk_create([
+            get_user_model()(
+                username='user{}'.format(i), email='user{}@t.t'.format(i),
+            )
+            for i in range(500)
+        ])
+        users = get_user_model().objects.order_by('pk')
+        EmailAddress.objects.bulk_create_confirmed(
+            (user, user.email) for user in users[::2]
+        )
+        EmailAddress.objects.bulk_create_unconfirmed(
+            (user, user.email) for user in users[1::2]
+        )
+
+    def test_listing_users_uses_constant_queries(self):
+        with self.assertNumQueries(2):
+            users = list(
+                get_user_model().objects.with_email_status().order_by('pk')
+            )
+            statuses = [user.is_confirmed for user in users]
+            for user in users:
+                user.confirmed_at
+                user.get_confirmed_emails()
+                user.get_unconfirmed_emails()
+
+        self.assertEqual(len(users), 500)
+        self.assertEqual(statuses, [True, False] * 250)
+
+    def test_mutation_discards_prefetched_addresses(self):
+        user = get_user_model().objects.with_email_status().get(
+            username='user1',
+        )
+        self.assertFalse(user.is_confirmed)
+        user.confirm_email(user.get_confirmation_key())
+        self.assertTrue(user.is_confirmed)
+
+
+class PrimaryConfirmedQuerySetTestCase(TestCase):
+
+    def setUp(self):
+        self.confirmed = get_user_model().objects.create_user(
+            'confirmed', email='confirmed@t.t',
+        )
+        self.confirmed.confirm_email(self.confirmed.get_confirmation_key())
+        self.unconfirmed = get_user_model().objects.create_user(
+            'unconfirmed', email='unconfirmed@t.t',
+        )
+        # a confirmed secondary address doesn't confirm the primary one
+        self.unconfirmed.add_confirmed_email('secondary@t.t')
+        self.no_email = get_user_model().objects.create_user('noemail')
+
+    def test_annotate_primary_confirmed(self):
+        users = get_user_model().objects.annotate_primary_confirmed()
+        statuses = {
+            user.username: user.primary_email_confirmed for user in users
+        }
+        self.assertEqual(statuses, {
+            'confirmed': True, 'unconfirmed': False, 'noemail': False,
+        })
+        for user in users:
+            self.assertEqual(user.primary_email_confirmed, user.is_confirmed)
+
+    def test_filter_primary_confirmed(self):
+        users = get_user_model().objects
+        with self.assertNumQueries(2):
+            self.assertEqual(users.primary_email_confirmed().count(), 1)
+            self.assertEqual(users.primary_email_unconfirmed().count(), 2)
+        self.assertEqual(
+            users.primary_email_confirmed().get(), self.confirmed,
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'query plans checked on SQLite')
+class IndexTestCase(TestCase):
+
+    def test_email_lookup_uses_index(self):
+        plan = EmailAddress.objects.filter(email='t@t.t').explain()
+        self.assertIn('sec_emailaddress_email', plan)
+
+    def test_expiry_sweep_uses_index(self):
+        plan = EmailAddress.objects.filter(
+            confirmed_at__isnull=True, set_at__lt=timezone.now(),
+        ).explain()
+        self.assertIn('sec_emailaddress_pending', plan)
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1))
+class PurgeExpiredTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='primary@t.t',
+        )
+        for i in range(5):
+            self.user.add_unconfirmed_email('expired{}@t.t'.format(i))
+        self.user.add_confirmed_email('confirmed@t.t')
+        EmailAddress.objects.update(set_at=timezone.now() - timedelta(days=2))
+        self.user.add_unconfirmed_email('fresh@t.t')
+
+    def remaining(self):
+        return sorted(EmailAddress.objects.values_list('email', flat=True))
+
+    def test_purge_expired(self):
+        batches = list(EmailAddress.objects.purge_expired(batch_size=2))
+
+        self.assertEqual([deleted for deleted, _ in batches], [2, 2, 1])
+        self.assertEqual(
+            self.remaining(), ['confirmed@t.t', 'fresh@t.t', 'primary@t.t'],
+        )
+
+    def test_purge_expired_include_primary(self):
+        list(EmailAddress.objects.purge_expired(include_primary=True))
+        self.assertEqual(self.remaining(), ['confirmed@t.t', 'fresh@t.t'])
+
+    def test_purge_expired_resume(self):
+        batches = EmailAddress.objects.purge_expired(batch_size=2)
+        _, last_pk = next(batches)
+        batches.close()
+
+        list(EmailAddress.objects.purge_expired(start_after=last_pk))
+        self.assertEqual(
+            self.remaining(), ['confirmed@t.t', 'fresh@t.t', 'primary@t.t'],
+        )
+
+    @override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=None)
+    def test_purge_without_period(self):
+        self.assertEqual(list(EmailAddress.objects.purge_expired()), [])
+        self.assertEqual(len(self.remaining()), 8)
+
+    def test_command(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+
+        call_command(
+            'purge_expired_email_addresses', batch_size=3, archive=path,
+            stdout=out,
+        )
+
+        self.assertIn('Deleted 5 expired addresses', out.getvalue())
+        with open(path) as archive:
+            archived = [json.loads(line)['email'] for line in archive]
+        self.assertEqual(
+            archived, ['expired{}@t.t'.format(i) for i in range(5)],
+        )
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1))
+class EmailAddressQuerySetTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='fresh@t.t',
+        )
+        self.user.add_unconfirmed_email('expired@t.t')
+        self.user.add_confirmed_email('confirmed@t.t')
+        self.user.email_address_set.exclude(email='fresh@t.t').update(
+            set_at=timezone.now() - timedelta(days=2),
+        )
+
+    def emails(self, queryset):
+        return sorted(queryset.values_list('email', flat=True))
+
+    def test_filters(self):
+        addresses = EmailAddress.objects
+        self.assertEqual(self.emails(addresses.confirmed()), ['confirmed@t.t'])
+        self.assertEqual(
+            self.emails(addresses.unconfirmed()), ['expired@t.t', 'fresh@t.t'],
+        )
+        self.assertEqual(
+            self.emails(addresses.expired()), ['confirmed@t.t', 'expired@t.t'],
+        )
+        self.assertEqual(self.emails(addresses.unexpired()), ['fresh@t.t'])
+        self.assertEqual(
+            self.emails(self.user.email_address_set.unconfirmed().expired()),
+            ['expired@t.t'],
+        )
+        for address in EmailAddress.objects.all():
+            self.assertEqual(
+                address.is_key_expired,
+                addresses.expired().filter(pk=address.pk).exists(),
+            )
+
+    @override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=None)
+    def test_filters_without_period(self):
+        self.assertEqual(EmailAddress.objects.expired().count(), 0)
+        self.assertEqual(EmailAddress.objects.unexpired().count(), 3)
+        self.assertEqual(
+            EmailAddress.objects.status_counts(),
+            {'confirmed': 1, 'unconfirmed': 2, 'expired': 0},
+        )
+
+    def test_status_counts(self):
+        with self.assertNumQueries(1):
+            counts = EmailAddress.objects.status_counts()
+        self.assertEqual(
+            counts, {'confirmed': 1, 'unconfirmed': 2, 'expired': 1},
+        )
+
+    def test_confirm_rejects_expired_key(self):
+        key = self.user.get_confirmation_key('expired@t.t')
+        with self.assertRaises(EmailConfirmationExpired):
+            EmailAddress.objects.confirm(key)
+        address = EmailAddress.objects.confirm(
+            self.user.get_confirmation_key(),
+        )
+        self.assertTrue(address.is_confirmed)
+
+
+class ConfirmOnceTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='nobody@important.com',
+        )
+        self.key = self.user.get_confirmation_key()
+        self.user = get_user_model().objects.get(pk=self.user.pk)
+
+        self.signals = []
+
+        def listener(sender, user, email, **kwargs):
+            self.signals.append((user, email))
+        email_confirmed.connect(listener)
+        self.addCleanup(email_confirmed.disconnect, listener)
+
+    def assert_confirmed_once(self):
+        address, confirmed = EmailAddress.objects.confirm_once(self.key)
+        self.assertTrue(confirmed)
+        self.assertTrue(address.is_confirmed)
+        self.assertEqual(address.email, self.user.email)
+        self.assertEqual(
+            address.confirmed_at,
+            EmailAddress.objects.get(pk=address.pk).confirmed_at,
+        )
+
+        address, confirmed = EmailAddress.objects.confirm_once(self.key)
+        self.assertFalse(confirmed)
+        self.assertTrue(address.is_confirmed)
+        self.assertEqual(self.signals, [(self.user, self.user.email)])
+
+    def test_confirm_once(self):
+        self.assert_confirmed_once()
+
+    def test_confirm_once_without_update_returning(self):
+        with mock.patch(
+            'simple_email_confirmation.models._can_update_returning',
+            return_value=False,
+        ):
+            self.assert_confirmed_once()
+
+    @skipUnless(connection.vendor == 'sqlite', 'RETURNING checked on SQLite')
+    def test_confirm_email_in_one_query(self):
+        with self.assertNumQueries(1):
+            self.user.confirm_email(self.key)
+        self.assertEqual(len(self.signals), 1)
+
+    @skipUnless(connection.vendor == 'sqlite', 'RETURNING checked on SQLite')
+    def test_confirm_once_without_user_queries(self):
+        # the User is read for the signal
+        with self.assertNumQueries(2):
+            EmailAddress.objects.confirm_once(self.key)
+        # a used key is looked up after the update matches nothing
+        with self.assertNumQueries(2):
+            EmailAddress.objects.confirm_once(self.key)
+
+    def test_confirm_once_invalid_or_expired_key(self):
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            EmailAddress.objects.confirm_once('invalid')
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(0)):
+            with self.assertRaises(EmailConfirmationExpired):
+                EmailAddress.objects.confirm_once(self.key)
+        self.assertEqual(self.signals, [])
+
+    def test_confirm_without_save(self):
+        address = EmailAddress.objects.confirm(self.key, save=False)
+        self.assertTrue(address.is_confirmed)
+        self.assertFalse(EmailAddress.objects.get(pk=address.pk).is_confirmed)
+        self.assertEqual(self.signals, [])
+
+
+class BulkConfirmTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('uname')
+        self.other = get_user_model().objects.create_user('other')
+        self.keys = [
+            self.user.add_unconfirmed_email('a@example.com'),
+            self.user.add_unconfirmed_email('b@Example.COM'),
+            self.other.add_unconfirmed_email('c@sub.example.com'),
+            self.other.add_unconfirmed_email('d@t.t'),
+        ]
+        self.batches = []
+
+        def listener(sender, addresses, **kwargs):
+            self.batches.append(sorted(a.email for a in addresses))
+        emails_confirmed.connect(listener)
+        self.addCleanup(emails_confirmed.disconnect, listener)
+
+    def confirmed(self):
+        return sorted(
+            EmailAddress.objects.confirmed().values_list('email', flat=True)
+        )
+
+    def test_bulk_confirm_keys(self):
+        self.user.confirm_email(self.keys[1])
+        keys = self.keys[:2] + ['unknown']
+
+        with self.assertNumQueries(1):
+            addresses = EmailAddress.objects.bulk_confirm(keys)
+
+        self.assertEqual([a.email for a in addresses], ['a@example.com'])
+        self.assertTrue(addresses[0].is_confirmed)
+        self.assertEqual(self.batches, [['a@example.com']])
+        self.assertEqual(self.confirmed(), ['a@example.com', 'b@Example.COM'])
+        # the cached status is refreshed
+        self.assertEqual(len(self.user.get_confirmed_emails()), 2)
+
+    def test_bulk_confirm_in_batches(self):
+        addresses = EmailAddress.objects.bulk_confirm(
+            iter(self.keys), batch_size=3,
+        )
+        self.assertEqual(len(addresses), 4)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 1])
+
+    def test_bulk_confirm_skips_expired(self):
+        EmailAddress.objects.filter(email='d@t.t').update(
+            set_at=timezone.now() - timedelta(days=2),
+        )
+        with self.settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1)):
+            addresses = EmailAddress.objects.bulk_confirm(self.keys)
+        self.assertEqual(len(addresses), 3)
+        self.assertNotIn('d@t.t', self.confirmed())
+
+    def test_bulk_confirm_queryset(self):
+        queryset = EmailAddress.objects.filter(user=self.other)
+        addresses = EmailAddress.objects.bulk_confirm(queryset)
+        self.assertEqual(
+            sorted(a.email for a in addresses), ['c@sub.example.com', 'd@t.t'],
+        )
+        self.assertEqual(EmailAddress.objects.bulk_confirm(queryset), [])
+        self.assertEqual(len(self.batches), 1)
+
+    def test_bulk_confirm_without_returning(self):
+        with mock.patch(
+            'simple_email_confirmation.models._can_update_returning',
+            return_value=False,
+        ):
+            addresses = EmailAddress.objects.bulk_confirm(self.keys[:3])
+        self.assertEqual(len(addresses), 3)
+        self.assertEqual(len(self.confirmed()), 3)
+
+    def test_bulk_confirm_domain(self):
+        addresses = EmailAddress.objects.bulk_confirm_domain('example.com')
+        # any case, but no subdomains
+        self.assertEqual(
+            sorted(a.email for a in addresses),
+            ['a@example.com', 'b@Example.COM'],
+        )
+        self.assertEqual(self.confirmed(), ['a@example.com', 'b@Example.COM'])
+
+    @override_settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='hashed')
+    def test_bulk_confirm_hashed_keys(self):
+        keys = [
+            self.user.add_unconfirmed_email('hashed@t.t'),
+            self.keys[0],  # stored before hashing was turned on
+        ]
+        addresses = EmailAddress.objects.bulk_confirm(keys)
+        self.assertEqual(
+            sorted(a.email for a in addresses),
+            ['a@example.com', 'hashed@t.t'],
+        )
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='signed',
+        SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1),
+    )
+    def test_bulk_confirm_signed_keys(self):
+        keys = [
+            self.user.add_unconfirmed_email('new@t.t'),
+            self.user.add_unconfirmed_email('new@t.t'),
+            self.user.get_confirmation_key('a@example.com'),
+            'not-signed',
+        ]
+        used = self.user.get_confirmation_key('b@Example.COM')
+        self.user.confirm_email(used)
+
+        addresses = EmailAddress.objects.bulk_confirm(keys + [used])
+
+        self.assertEqual(
+            sorted(a.email for a in addresses), ['a@example.com', 'new@t.t'],
+        )
+        self.assertEqual(
+            sorted(self.user.get_confirmed_emails()),
+            ['a@example.com', 'b@Example.COM', 'new@t.t'],
+        )
+        self.assertEqual(self.batches, [['a@example.com', 'new@t.t']])
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='signed',
+        SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1),
+    )
+    def test_bulk_confirm_signed_skips_concurrent_inserts(self):
+        keys = [
+            self.user.add_unconfirmed_email('new@t.t'),
+            self.user.add_unconfirmed_email('other@t.t'),
+        ]
+        manager = EmailAddress.objects
+        generate_unused_keys = manager.generate_unused_keys
+
+        def confirm_first(count):
+            # another request confirms new@t.t after the rows were read
+            self.user.confirm_email(keys[0])
+            return generate_unused_keys(count)
+
+        with mock.patch.object(
+            manager, 'generate_unused_keys', side_effect=confirm_first,
+        ):
+            addresses = manager.bulk_confirm(keys)
+
+        self.assertEqual([a.email for a in addresses], ['other@t.t'])
+        self.assertEqual(self.batches, [['other@t.t']])
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='hashed')
+class HashedKeyTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('uname')
+
+    def test_only_digest_is_stored(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+
+        address = self.user.email_address_set.get(email='t@t.t')
+        self.assertEqual(address.key, hash_key(key))
+        self.assertEqual(len(address.key), 23)
+        self.assertEqual(len(address.key), len(hash_key('other')))
+        with self.assertRaises(EmailConfirmationKeyNotStored):
+            self.user.get_confirmation_key('t@t.t')
+
+        self.assertEqual(self.user.confirm_email(key), 't@t.t')
+        self.assertIn('t@t.t', self.user.get_confirmed_emails())
+
+    def test_digest_is_not_a_key(self):
+        self.user.add_unconfirmed_email('t@t.t')
+        address = self.user.email_address_set.get(email='t@t.t')
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email(address.key)
+
+    def test_raw_key_returned_once(self):
+        self.user.add_unconfirmed_email('t@t.t')
+        key = self.user.reset_email_confirmation('t@t.t')
+        self.assertEqual(
+            self.user.email_address_set.get(email='t@t.t').key, hash_key(key),
+        )
+        addresses = EmailAddress.objects.bulk_create_unconfirmed(
+            [(self.user, 'bulk@t.t')],
+        )
+        EmailAddress.objects.confirm(addresses[0].raw_key)
+
+        keys = []
+
+        def listener(sender, user, email, key, **kwargs):
+            keys.append(key)
+        unconfirmed_email_created.connect(listener)
+        self.addCleanup(unconfirmed_email_created.disconnect, listener)
+        key = self.user.add_unconfirmed_email('signal@t.t')
+        self.assertEqual(keys, [key])
+
+    def test_hash_stored_keys(self):
+        with self.settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='plaintext'):
+            keys = [
+                self.user.add_unconfirmed_email('{}@t.t'.format(i))
+                for i in range(3)
+            ]
+        # plaintext keys still work until they're hashed
+        self.user.confirm_email(keys[0])
+
+        call_command('hash_confirmation_keys', batch_size=2, stdout=StringIO())
+
+        stored = set(EmailAddress.objects.values_list('key', flat=True))
+        self.assertEqual(stored, set(hash_key(key) for key in keys))
+        self.user.confirm_email(keys[1])
+        self.assertEqual(len(self.user.get_confirmed_emails()), 2)
+
+
+@override_settings(
+    SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='signed',
+    SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1),
+)
+class SignedKeyTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='nobody@important.com',
+        )
+
+    def test_keys_cost_no_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.add_unconfirmed_email('t@t.t')
+            key = self.user.get_confirmation_key('t@t.t')
+            self.user.add_email_if_not_exists('other@t.t')
+        self.assertEqual(
+            [q['sql'] for q in queries if not q['sql'].startswith('SELECT')],
+            [],
+        )
+        self.assertEqual(self.user.email_address_set.count(), 0)
+        self.assertEqual(self.user.confirm_email(key), 't@t.t')
+
+    def test_confirm_writes_address(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+
+        address, confirmed = EmailAddress.objects.confirm_once(key)
+        self.assertTrue(confirmed)
+        self.assertEqual(address.user, self.user)
+        self.assertIn('t@t.t', self.user.get_confirmed_emails())
+
+        address, confirmed = EmailAddress.objects.confirm_once(key)
+        self.assertFalse(confirmed)
+        self.assertTrue(address.is_confirmed)
+
+    def test_confirm_existing_unconfirmed_address(self):
+        with self.settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='plaintext'):
+            self.user.add_unconfirmed_email('t@t.t')
+
+        self.user.confirm_email(self.user.get_confirmation_key('t@t.t'))
+
+        self.assertEqual(self.user.email_address_set.count(), 1)
+        self.assertIn('t@t.t', self.user.get_confirmed_emails())
+
+    def test_confirm_without_save(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+        address = EmailAddress.objects.confirm(key, save=False)
+        self.assertTrue(address.is_confirmed)
+        self.assertEqual(self.user.email_address_set.count(), 0)
+
+    def test_invalid_keys(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+        other_user = get_user_model().objects.create_user('other')
+
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email(key[:-1])
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            other_user.confirm_email(key)
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(0)):
+            sleep(1)
+            with self.assertRaises(EmailConfirmationExpired):
+                self.user.confirm_email(key)
+        self.assertEqual(self.user.get_confirmed_emails(), [])
+
+
+    def test_needs_period(self):
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=None):
+            with self.assertRaises(ImproperlyConfigured):
+                self.user.add_unconfirmed_email('t@t.t')
+
+    def test_unstored_primary_email(self):
+        self.assertIsNone(self.user.confirmed_at)
+        self.assertFalse(self.user.is_confirmed)
+
+    def test_add_stored_address_raises(self):
+        self.user.add_confirmed_email('t@t.t')
+        with self.assertRaises(IntegrityError):
+            self.user.add_unconfirmed_email('t@t.t')
+
+    def test_removal_revokes_key(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+        self.user.confirm_email(key)
+        self.user.remove_email('t@t.t')
+
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email(key)
+        self.assertEqual(self.user.email_address_set.count(), 0)
+
+        # a key made after the removal works
+        key = self.user.add_unconfirmed_email('t@t.t')
+        self.assertEqual(self.user.confirm_email(key), 't@t.t')
+
+    def test_reset_revokes_key(self):
+        key = self.user.add_unconfirmed_email('t@t.t')
+        self.user.confirm_email(key)
+        new_key = self.user.reset_email_confirmation('t@t.t')
+
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email(key)
+        self.assertNotIn('t@t.t', self.user.get_confirmed_emails())
+        self.assertEqual(self.user.confirm_email(new_key), 't@t.t')
+
+    def test_reset_of_unstored_address_revokes_key(self):
+        address = EmailAddress.objects.create_unconfirmed('t@t.t', self.user)
+        key = address.raw_key
+        new_key = address.reset_confirmation(force=True)
+
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email(key)
+        self.assertEqual(self.user.confirm_email(new_key), 't@t.t')
+
+    def test_purge_drops_old_revocations(self):
+        self.user.add_confirmed_email('t@t.t')
+        self.user.remove_email('t@t.t')
+        SignedKeyRevocation.objects.update(
+            revoked_at=timezone.now() - timedelta(days=2),
+        )
+        list(EmailAddress.objects.purge_expired())
+        self.assertFalse(SignedKeyRevocation.objects.exists())
+
+
+class AsyncTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'uname', email='nobody@important.com',
+        )
+        self.user = get_user_model().objects.get(pk=self.user.pk)
+        self.key = self.user.get_confirmation_key()
+        self.user.clear_email_address_cache()
+
+        self.handoffs = []
+        call = SyncToAsync.__call__
+        handoffs = self.handoffs
+
+        async def counting_call(self, *args, **kwargs):
+            handoffs.append(self.func)
+            return await call(self, *args, **kwargs)
+        patcher = mock.patch.object(SyncToAsync, '__call__', counting_call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_status_lookups(self):
+        self.assertFalse(await self.user.ais_confirmed())
+        self.assertEqual(len(self.handoffs), 1)
+
+        self.assertEqual(await self.user.aget_confirmed_emails(), [])
+        self.assertEqual(
+            await self.user.aget_unconfirmed_emails(), [self.user.email],
+        )
+        self.assertEqual(len(self.handoffs), 1)
+
+    async def test_aconfirm_email(self):
+        received = []
+
+        async def listener(sender, user, email, **kwargs):
+            received.append(email)
+        email_confirmed.connect(listener)
+        self.addCleanup(email_confirmed.disconnect, listener)
+
+        self.assertEqual(
+            await self.user.aconfirm_email(self.key), self.user.email,
+        )
+
+        # the conditional update is the only trip to the database thread,
+        # and the async receiver runs on the event loop
+        self.assertEqual(len(self.handoffs), 1)
+        self.assertEqual(received, [self.user.email])
+        self.assertTrue(await self.user.ais_confirmed())
+
+    async def test_sync_and_async_receivers(self):
+        received = []
+
+        def sync_listener(sender, user, email, **kwargs):
+            received.append('sync')
+
+        async def async_listener(sender, user, email, **kwargs):
+            received.append('async')
+        for listener in (sync_listener, async_listener):
+            email_confirmed.connect(listener)
+            self.addCleanup(email_confirmed.disconnect, listener)
+
+        await self.user.aconfirm_email(self.key)
+
+        # sync receivers get one more trip to a thread; the order between
+        # them and async ones is unspecified
+        self.assertEqual(len(self.handoffs), 2)
+        self.assertEqual(sorted(received), ['async', 'sync'])
+
+    async def test_aconfirm_without_user(self):
+        address, confirmed = await EmailAddress.objects.aconfirm_once(self.key)
+        self.assertTrue(confirmed)
+        self.assertEqual(address.user, self.user)
+        address = await EmailAddress.objects.aconfirm(self.key)
+        self.assertTrue(address.is_confirmed)
+
+    async def test_add_and_set_primary_email(self):
+        self.assertTrue(
+            await self.user.aadd_email_if_not_exists(self.user.email),
+        )
+        key = await self.user.aadd_email_if_not_exists('new@t.t')
+        self.assertIn('new@t.t', await self.user.aget_unconfirmed_emails())
+        with self.assertRaises(EmailNotConfirmed):
+            await self.user.aset_primary_email('new@t.t')
+
+        new_key = await self.user.areset_email_confirmation('new@t.t')
+        self.assertNotEqual(new_key, key)
+        await self.user.aconfirm_email(new_key)
+        await self.user.aset_primary_email('new@t.t')
+        self.assertTrue(await self.user.ais_confirmed())
+
+        await self.user.aadd_confirmed_email('other@t.t')
+        self.assertIsNone(await self.user.aadd_email_if_not_exists('other@t.t'))
+        await self.user.aremove_email('other@t.t')
+        self.assertNotIn('other@t.t', await self.user.aget_confirmed_emails())
+
+    async def test_acreate_unconfirmed(self):
+        received = []
+
+        async def listener(sender, user, email, key, **kwargs):
+            received.append(key)
+        unconfirmed_email_created.connect(listener)
+        self.addCleanup(unconfirmed_email_created.disconnect, listener)
+
+        address = await EmailAddress.objects.acreate_unconfirmed(
+            'new@t.t', user=self.user,
+        )
+
+        self.assertEqual(len(self.handoffs), 1)
+        self.assertEqual(received, [address.raw_key])
+        self.assertEqual(address.key, address.raw_key)
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_CACHE='default')
+class CacheTestCase(TransactionTestCase):
+    # addresses read inside a transaction aren't cached
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_counters()
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.key = self.user.add_unconfirmed_email('b@t.t')
+
+    def fresh_user(self):
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_hit_skips_database(self):
+        self.assertFalse(self.fresh_user().is_confirmed)
+
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertFalse(user.is_confirmed)
+            self.assertEqual(
+                set(user.unconfirmed_emails), set(['a@t.t', 'b@t.t']),
+            )
+            address = user.get_email_addresses()[0]
+            self.assertEqual(address.user, user)
+        self.assertEqual(
+            metrics.get_counters(), {'cache.hits': 1, 'cache.misses': 1},
+        )
+
+    def test_writes_invalidate(self):
+        def emails():
+            user = self.fresh_user()
+            return set(user.confirmed_emails), set(user.unconfirmed_emails)
+
+        self.assertEqual(emails(), (set(), set(['a@t.t', 'b@t.t'])))
+
+        self.user.confirm_email(self.key)
+        self.assertEqual(emails(), (set(['b@t.t']), set(['a@t.t'])))
+
+        self.user.set_primary_email('b@t.t')
+        self.assertEqual(self.fresh_user().email, 'b@t.t')
+
+        self.user.reset_email_confirmation('b@t.t')
+        self.assertEqual(emails(), (set(), set(['a@t.t', 'b@t.t'])))
+
+        self.user.add_confirmed_email('c@t.t')
+        self.assertEqual(emails(), (set(['c@t.t']), set(['a@t.t', 'b@t.t'])))
+
+        self.user.remove_email('c@t.t')
+        self.assertEqual(emails(), (set(), set(['a@t.t', 'b@t.t'])))
+
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.bulk_create_unconfirmed([(self.user, 'd@t.t')])
+        self.assertIn('d@t.t', emails()[1])
+
+    def test_direct_writes_invalidate(self):
+        def emails():
+            user = self.fresh_user()
+            return set(user.confirmed_emails), set(user.unconfirmed_emails)
+
+        self.assertEqual(emails(), (set(), set(['a@t.t', 'b@t.t'])))
+
+        address = self.user.email_address_set.get(email='b@t.t')
+        address.confirmed_at = timezone.now()
+        address.save()
+        self.assertEqual(emails(), (set(['b@t.t']), set(['a@t.t'])))
+
+        address.delete()
+        self.assertEqual(emails(), (set(), set(['a@t.t'])))
+
+        cache_key = 'simple_email_confirmation:addresses:{}'.format(
+            self.user.pk,
+        )
+        self.assertIsNotNone(cache.get(cache_key))
+        self.user.delete()
+        self.assertIsNone(cache.get(cache_key))
+
+    def test_app_writes_invalidate_once(self):
+        with mock.patch.object(
+            cache, 'delete_many', wraps=cache.delete_many,
+        ) as delete_many:
+            self.user.add_unconfirmed_email('c@t.t')
+            self.user.reset_email_confirmation('c@t.t')
+            self.user.remove_email('c@t.t')
+        # once per write, rather than again from the post_save and
+        # post_delete receivers, and once more as the delete's transaction
+        # commits
+        self.assertEqual(delete_many.call_count, 4)
+
+    def test_receivers_only_with_cache(self):
+        EmailAddress = get_email_address_model()
+        self.assertTrue(post_delete.has_listeners(EmailAddress))
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_CACHE=None):
+            self.assertFalse(post_delete.has_listeners(EmailAddress))
+            self.assertFalse(post_save.has_listeners(EmailAddress))
+        self.assertTrue(post_save.has_listeners(EmailAddress))
+
+    def test_rolled_back_reads_not_cached(self):
+        with transaction.atomic():
+            self.user.add_email_if_not_exists('x@t.t')
+            self.assertIn('x@t.t', self.fresh_user().unconfirmed_emails)
+            transaction.set_rollback(True)
+        self.assertEqual(
+            set(self.fresh_user().unconfirmed_emails), set(['a@t.t', 'b@t.t']),
+        )
+
+    def test_off_by_default(self):
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_CACHE=None):
+            self.fresh_user().is_confirmed
+            self.assertEqual(metrics.get_counters(), {})
+            self.assertIsNone(cache.get(
+                'simple_email_confirmation:addresses:{}'.format(self.user.pk),
+            ))
+
+
+class EmailConfirmationStatusMiddlewareTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.key = self.user.add_unconfirmed_email('b@t.t')
+        self.request = RequestFactory().get('/')
+        self.request.user = get_user_model().objects.get(pk=self.user.pk)
+
+    def run_middleware(self, view):
+        middleware = EmailConfirmationStatusMiddleware(view)
+        return middleware(self.request)
+
+    def fresh_user(self):
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_one_read_per_request(self):
+        def view(request):
+            self.assertFalse(request.user.is_confirmed)
+            with self.assertNumQueries(1):
+                # only the User itself is read
+                user = self.fresh_user()
+                self.assertFalse(user.is_confirmed)
+                self.assertIsNone(user.confirmed_at)
+            return 'response'
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.run_middleware(view), 'response')
+
+        # the memo doesn't outlive the request
+        self.assertNotIn('_email_address_snapshot', self.request.user.__dict__)
+        with self.assertNumQueries(2):
+            self.assertFalse(self.fresh_user().is_confirmed)
+
+    def test_mutations_clear_memo(self):
+        def view(request):
+            self.assertFalse(self.fresh_user().is_confirmed)
+            request.user.confirm_email(self.key)
+            request.user.set_primary_email('b@t.t')
+            self.assertTrue(self.fresh_user().is_confirmed)
+
+            EmailAddress = get_email_address_model()
+            EmailAddress.objects.get(email='b@t.t').reset_confirmation()
+            self.assertFalse(self.fresh_user().is_confirmed)
+            return 'response'
+
+        self.run_middleware(view)
+
+    def test_untouched_lazy_user(self):
+        self.request.user = SimpleLazyObject(self.fresh_user)
+        with self.assertNumQueries(0):
+            self.run_middleware(lambda request: 'response')
+
+
+class ListSignalQueue(dispatch.BaseSignalQueue):
+
+    def __init__(self):
+        self.items = []
+
+    def put(self, name, kwargs):
+        self.items.append((name, kwargs))
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_SIGNAL_DISPATCH='deferred')
+class DeferredDispatchTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        patcher = mock.patch.object(dispatch, '_queue', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.received = []
+
+        def listener(sender, user, email, **kwargs):
+            self.received.append((threading.current_thread(), email))
+        email_confirmed.connect(listener)
+        self.addCleanup(email_confirmed.disconnect, listener)
+
+    def test_delivered_after_commit_from_worker(self):
+        key = self.user.add_unconfirmed_email('b@t.t')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.confirm_email(key)
+        self.assertEqual(self.received, [])
+
+        for callback in callbacks:
+            callback()
+        dispatch.get_queue().join()
+        self.assertEqual(len(self.received), 1)
+        thread, email = self.received[0]
+        self.assertEqual(email, 'b@t.t')
+        self.assertNotEqual(thread, threading.current_thread())
+
+    def test_rolled_back_never_delivered(self):
+        key = self.user.add_unconfirmed_email('b@t.t')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.user.confirm_email(key)
+                    raise ValueError
+        self.assertEqual(callbacks, [])
+
+    def test_bursts_coalesced(self):
+        batches = []
+        release = threading.Event()
+        original = dispatch.deliver
+
+        def deliver(batch):
+            batches.append([kwargs['email'] for name, kwargs in batch])
+            release.wait(5)
+            original(batch)
+
+        queue = dispatch.ThreadPoolSignalQueue()
+        with mock.patch.object(dispatch, 'deliver', deliver):
+            for email in ['b@t.t', 'c@t.t', 'd@t.t']:
+                queue.put('email_confirmed', {
+                    'sender': self.user.__class__, 'user': self.user,
+                    'email': email,
+                })
+            release.set()
+            queue.join()
+
+        self.assertEqual(batches, [['b@t.t'], ['c@t.t', 'd@t.t']])
+        self.assertEqual(
+            [email for thread, email in self.received],
+            ['b@t.t', 'c@t.t', 'd@t.t'],
+        )
+
+    def test_failing_receiver_logged(self):
+        def broken(sender, **kwargs):
+            raise RuntimeError('broken')
+        email_confirmed.connect(broken)
+        self.addCleanup(email_confirmed.disconnect, broken)
+
+        with self.assertLogs('simple_email_confirmation.dispatch', 'ERROR'):
+            dispatch.deliver([('email_confirmed', {
+                'sender': self.user.__class__, 'user': self.user,
+                'email': 'a@t.t',
+            })])
+        self.assertEqual(len(self.received), 1)
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_SIGNAL_QUEUE=(
+            'simple_email_confirmation.tests.tests.ListSignalQueue'
+        ),
+    )
+    def test_custom_queue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.add_unconfirmed_email('b@t.t')
+        queue = dispatch.get_queue()
+        self.assertIsInstance(queue, ListSignalQueue)
+        [(name, kwargs)] = queue.items
+        self.assertEqual(name, 'unconfirmed_email_created')
+        self.assertEqual(kwargs['email'], 'b@t.t')
+
+    @override_settings(SIMPLE_EMAIL_CONFIRMATION_SIGNAL_DISPATCH='sometimes')
+    def test_unknown_mode(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.user.add_unconfirmed_email('b@t.t')
+
+
+class ConfirmationEmailTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+
+    def test_send_confirmation_email(self):
+        key = self.user.add_unconfirmed_email('b@t.t')
+        self.assertEqual(mail.send_confirmation_email(self.user, 'b@t.t', key), 1)
+
+        [message] = django_mail.outbox
+        self.assertEqual(message.to, ['b@t.t'])
+        self.assertEqual(message.subject, 'Confirm your email address')
+        self.assertIn(key, message.body)
+        self.assertEqual(message.alternatives, [])
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_URL='https://t.t/confirm/{key}/?a=1&b=2',
+        SIMPLE_EMAIL_CONFIRMATION_FROM_EMAIL='confirm@t.t',
+    )
+    def test_confirmation_url(self):
+        key = self.user.reset_email_confirmation('a@t.t')
+        mail.send_confirmation_email(self.user, 'a@t.t', key)
+
+        [message] = django_mail.outbox
+        self.assertEqual(message.from_email, 'confirm@t.t')
+        self.assertIn(
+            'https://t.t/confirm/{}/?a=1&b=2'.format(key), message.body,
+        )
+
+    def test_one_connection_per_batch(self):
+        users = [
+            get_user_model().objects.create_user('user{}'.format(i))
+            for i in range(5)
+        ]
+        EmailAddress = get_email_address_model()
+        addresses = EmailAddress.objects.bulk_create_unconfirmed(
+            (user, '{}@t.t'.format(user.username)) for user in users
+        )
+
+        with mock.patch.object(
+            mail, 'get_connection', wraps=mail.get_connection,
+        ) as get_connection:
+            sent = mail.send_confirmation_emails(addresses, batch_size=2)
+
+        self.assertEqual(sent, 5)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(
+            [message.to for message in django_mail.outbox],
+            [[address.email] for address in addresses],
+        )
+        for address, message in zip(addresses, django_mail.outbox):
+            self.assertIn(address.raw_key, message.body)
+
+    def test_stored_keys(self):
+        # addresses read back from the database use their stored key
+        address = self.user.email_address_set.get()
+        mail.send_confirmation_emails([address])
+        self.assertIn(address.key, django_mail.outbox[0].body)
+
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='hashed'):
+            with self.assertRaises(EmailConfirmationKeyNotStored):
+                mail.send_confirmation_emails([address])
+
+    def test_signal_receivers(self):
+        unconfirmed_email_created.connect(mail.send_on_unconfirmed_email_created)
+        self.addCleanup(
+            unconfirmed_email_created.disconnect,
+            mail.send_on_unconfirmed_email_created,
+        )
+        unconfirmed_emails_created.connect(
+            mail.send_on_unconfirmed_emails_created,
+        )
+        self.addCleanup(
+            unconfirmed_emails_created.disconnect,
+            mail.send_on_unconfirmed_emails_created,
+        )
+
+        key = self.user.add_unconfirmed_email('b@t.t')
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.bulk_create_unconfirmed([(self.user, 'c@t.t')])
+
+        self.assertEqual(
+            [message.to for message in django_mail.outbox],
+            [['b@t.t'], ['c@t.t']],
+        )
+        self.assertIn(key, django_mail.outbox[0].body)
+
+
+class DictRateLimitStorage(throttling.RateLimitStorage):
+
+    def __init__(self):
+        self.counts = {}
+
+    def hit(self, key, period):
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return self.counts[key]
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_RESEND_COOLDOWN=timedelta(minutes=1))
+class ResendCooldownTestCase(TestCase):
+
+    def setUp(self):
+        metrics.reset_counters()
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.key = self.user.get_confirmation_key()
+
+    def test_existing_key_within_cooldown(self):
+        with self.assertNumQueries(1):
+            # the one query reads the address
+            self.assertEqual(self.user.add_email_if_not_exists('a@t.t'), self.key)
+        self.assertEqual(self.user.reset_email_confirmation('a@t.t'), self.key)
+        self.assertEqual(metrics.get_counters(), {'resend.suppressed': 2})
+
+        address = self.user.email_address_set.get()
+        new_key = address.reset_confirmation(force=True)
+        self.assertNotEqual(new_key, self.key)
+
+    def test_new_key_after_cooldown(self):
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.update(
+            set_at=timezone.now() - timedelta(minutes=2),
+        )
+        self.assertNotEqual(
+            self.user.add_email_if_not_exists('a@t.t'), self.key,
+        )
+        self.assertEqual(metrics.get_counters(), {})
+
+    def test_confirmed_address_reset(self):
+        self.user.confirm_email(self.key)
+        self.assertNotEqual(
+            self.user.reset_email_confirmation('a@t.t'), self.key,
+        )
+        self.assertFalse(self.user.is_confirmed)
+
+    @override_settings(SIMPLE_EMAIL_CONFIRMATION_KEY_MODE='hashed')
+    def test_hashed(self):
+        address = self.user.email_address_set.get()
+        address.key = hash_key(self.key)
+        address.save()
+        with self.assertRaises(EmailConfirmationThrottled):
+            address.reset_confirmation()
+        # a just-generated key is still known
+        key = self.user.add_unconfirmed_email('b@t.t')
+        address = self.user.email_address_set.get(email='b@t.t')
+        address.raw_key = key
+        self.assertEqual(address.reset_confirmation(), key)
+
+
+@override_settings(
+    SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE=(2, timedelta(hours=1)),
+)
+class ResendRateTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset_counters()
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.user.add_unconfirmed_email('b@t.t')
+
+    def test_per_user_and_per_email(self):
+        self.user.reset_email_confirmation('a@t.t')
+        self.user.reset_email_confirmation('a@t.t')
+        with self.assertRaises(EmailConfirmationThrottled):
+            self.user.reset_email_confirmation('a@t.t')
+        # the User's limit is shared between its addresses
+        with self.assertRaises(EmailConfirmationThrottled):
+            self.user.reset_email_confirmation('b@t.t')
+        self.assertEqual(metrics.get_counters(), {'resend.throttled': 2})
+
+        # and an email's limit is shared between Users, ignoring case
+        other = get_user_model().objects.create_user('other', email='c@t.t')
+        other.reset_email_confirmation('c@t.t')
+        other.add_unconfirmed_email('A@t.t')
+        with self.assertRaises(EmailConfirmationThrottled):
+            other.reset_email_confirmation('A@t.t')
+
+        # forced resets aren't counted
+        self.user.email_address_set.get(email='b@t.t').reset_confirmation(
+            force=True,
+        )
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE_STORAGE=(
+            'simple_email_confirmation.tests.tests.DictRateLimitStorage'
+        ),
+    )
+    def test_custom_storage(self):
+        with mock.patch.object(throttling, '_storage', None):
+            self.user.reset_email_confirmation('b@t.t')
+            self.assertEqual(
+                throttling.get_storage().counts,
+                {'user:{}'.format(self.user.pk): 1, 'email:b@t.t': 1},
+            )
+
+    async def test_async(self):
+        await self.user.areset_email_confirmation('a@t.t')
+        await self.user.areset_email_confirmation('a@t.t')
+        with self.assertRaises(EmailConfirmationThrottled):
+            await self.user.areset_email_confirmation('a@t.t')
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1))
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.user.confirm_email(self.user.get_confirmation_key())
+        self.user.add_unconfirmed_email('b@t.t')
+        self.user.add_unconfirmed_email('c@t.t')
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.filter(email='c@t.t').update(
+            set_at=timezone.now() - timedelta(days=2),
+        )
+
+    def test_rows(self):
+        rows = export.iter_rows(chunk_size=2)
+        self.assertEqual(
+            [(row['username'], row['email'], row['primary'],
+              row['confirmed'], row['expired']) for row in rows],
+            [
+                ('myname', 'a@t.t', True, True, False),
+                ('myname', 'b@t.t', False, False, False),
+                ('myname', 'c@t.t', False, False, True),
+            ],
+        )
+
+    def test_single_query(self):
+        get_user_model().objects.create_user('other', email='d@t.t')
+        with self.assertNumQueries(1):
+            # chunks are fetched from one cursor, users joined in
+            self.assertEqual(len(list(export.iter_rows(chunk_size=2))), 4)
+
+    def test_filters(self):
+        def emails(**filters):
+            return [row['email'] for row in export.iter_rows(**filters)]
+
+        self.assertEqual(emails(status='confirmed'), ['a@t.t'])
+        self.assertEqual(emails(status='unconfirmed'), ['b@t.t'])
+        self.assertEqual(emails(status='expired'), ['c@t.t'])
+        yesterday = timezone.now() - timedelta(days=1)
+        self.assertEqual(emails(set_before=yesterday), ['c@t.t'])
+        self.assertEqual(emails(set_after=yesterday), ['a@t.t', 'b@t.t'])
+        with self.assertRaises(ValueError):
+            emails(status='pending')
+
+    def test_command_csv(self):
+        stdout = StringIO()
+        call_command(
+            'export_email_addresses', status='expired', stdout=stdout,
+            stderr=StringIO(),
+        )
+        rows = list(csv.DictReader(StringIO(stdout.getvalue())))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['email'], 'c@t.t')
+        self.assertEqual(rows[0]['confirmed'], 'False')
+        self.assertEqual(rows[0]['confirmed_at'], '')
+
+    def test_command_jsonl_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.jsonl')
+            call_command(
+                'export_email_addresses', '--format', 'jsonl',
+                '--output', path, '--set-after', '2000-01-01T00:00:00',
+                stdout=StringIO(), stderr=StringIO(),
+            )
+            with open(path) as f:
+                rows = [json.loads(line) for line in f]
+        self.assertEqual(
+            [row['email'] for row in rows], ['a@t.t', 'b@t.t', 'c@t.t'],
+        )
+        self.assertIsNotNone(rows[0]['confirmed_at'])
+        self.assertIsNone(rows[1]['confirmed_at'])
+
+
+class ImportConfirmedTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.other = get_user_model().objects.create_user(
+            'other', email='o@t.t',
+        )
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        self.stderr = StringIO()
+        call_command(
+            'import_confirmed_email_addresses', *args, stdout=stdout,
+            stderr=self.stderr,
+        )
+        return stdout.getvalue()
+
+    def test_csv(self):
+        path = self.write('emails.csv', (
+            'user,email,confirmed_at\n'
+            'myname,a@t.t,\n'
+            'myname,b@t.t,2020-01-02T03:04:05\n'
+            'other,b@t.t,\n'
+            'nobody,n@t.t,\n'
+            'other,c@t.t,\n'
+        ))
+        with CaptureQueriesContext(connection) as queries:
+            output = self.run_command(
+                path, '--batch-size', '3', '--skip-unknown-users',
+            )
+        # two batches, of a user lookup, a duplicate check, a key check, an
+        # insert and a read back
+        self.assertEqual(len([
+            query for query in queries
+            if 'SAVEPOINT' not in query['sql']
+        ]), 10)
+
+        self.assertIn('Imported 3 of 5 addresses', output)
+        self.assertIn('3 rows read, 2 imported, 1 skipped, 0 unknown', output)
+        self.assertIn('5 rows read, 3 imported, 1 skipped, 1 unknown', output)
+        self.assertIn('Skipped 1 rows for unknown users', output)
+        self.assertEqual(
+            self.stderr.getvalue(), "Record 4 has an unknown user 'nobody'\n",
+        )
+        self.assertEqual(
+            self.user.email_address_set.get(email='b@t.t').confirmed_at,
+            timezone.make_aware(timezone.datetime(2020, 1, 2, 3, 4, 5)),
+        )
+        self.assertEqual(
+            sorted(self.other.get_confirmed_emails()), ['b@t.t', 'c@t.t'],
+        )
+        self.assertFalse(
+            self.user.email_address_set.get(email='a@t.t').is_confirmed,
+        )
+
+    def test_jsonl_by_pk(self):
+        path = self.write('emails.jsonl', '\n'.join(
+            json.dumps({'user': user.pk, 'email': 'new@t.t'})
+            for user in [self.user, self.other]
+        ))
+        self.run_command(path, '--user-field', 'pk')
+        self.assertEqual(
+            get_email_address_model().objects.confirmed().filter(
+                email='new@t.t',
+            ).count(),
+            2,
+        )
+
+    def test_dry_run(self):
+        path = self.write('emails.csv', 'user,email\nmyname,b@t.t\n')
+        output = self.run_command(path, '--dry-run')
+        self.assertIn('Would import 1 of 1 addresses', output)
+        self.assertFalse(
+            self.user.email_address_set.filter(email='b@t.t').exists(),
+        )
+
+    def test_unknown_user(self):
+        path = self.write('emails.csv', (
+            'user,email\n'
+            'myname,b@t.t\n'
+            'nobody,n@t.t\n'
+        ))
+        with self.assertRaisesMessage(
+            CommandError, "Record 2 has an unknown user 'nobody'",
+        ):
+            self.run_command(path)
+        self.assertFalse(
+            self.user.email_address_set.filter(email='b@t.t').exists(),
+        )
+
+    def test_invalid_record(self):
+        path = self.write('emails.csv', 'user,mail\nmyname,b@t.t\n')
+        with self.assertRaises(CommandError):
+            self.run_command(path)
+
+
+@override_settings(
+    ROOT_URLCONF='simple_email_confirmation.tests.myproject.urls',
+    SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(days=1),
+)
+class AdminTestCase(TestCase):
+
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(
+            'admin', email='admin@t.t', password='password',
+        )
+        self.client.force_login(self.admin)
+        self.users = [
+            get_user_model().objects.create_user(
+                'user{}'.format(i), email='user{}@t.t'.format(i),
+            )
+            for i in range(3)
+        ]
+        EmailAddress = get_email_address_model()
+        self.addresses = EmailAddress.objects.filter(
+            user__in=self.users,
+        ).order_by('pk')
+        self.url = '/admin/simple_email_confirmation/emailaddress/'
+
+    def get_changelist(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def run_action(self, action, addresses):
+        return self.client.post(self.url, {
+            'action': action,
+            'index': 0,
+            '_selected_action': [address.pk for address in addresses],
+        })
+
+    def test_changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_changelist()
+        # users are joined in rather than read per row
+        user_table = get_user_model()._meta.db_table
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('SELECT') and
+            'FROM "{}"'.format(user_table) in query['sql']
+        ]), 1)  # the logged-in user
+
+    def test_search(self):
+        key = self.users[1].get_confirmation_key()
+        self.assertEqual(
+            list(self.get_changelist(q='USER1@t.t').result_list),
+            [self.addresses[1]],
+        )
+        self.assertEqual(
+            list(self.get_changelist(q=key).result_list), [self.addresses[1]],
+        )
+        self.assertEqual(
+            set(self.get_changelist(q='user*').result_list),
+            set(self.addresses),
+        )
+        self.assertEqual(list(self.get_changelist(q='user').result_list), [])
+
+    def test_status_filter(self):
+        self.users[0].confirm_email(self.users[0].get_confirmation_key())
+        self.addresses.filter(user=self.users[1]).update(
+            set_at=timezone.now() - timedelta(days=2),
+        )
+
+        def emails(status):
+            return sorted(
+                address.email
+                for address in self.get_changelist(status=status).result_list
+            )
+        self.assertEqual(emails('confirmed'), ['user0@t.t'])
+        self.assertEqual(emails('unconfirmed'), ['admin@t.t', 'user2@t.t'])
+        self.assertEqual(emails('expired'), ['user1@t.t'])
+
+    def test_estimated_count_paginator(self):
+        paginator = EstimatedCountPaginator(self.addresses, 10)
+        with mock.patch.object(
+            EstimatedCountPaginator, 'get_estimate', return_value=5000000,
+        ):
+            self.assertEqual(paginator.count, 5000000)
+        paginator = EstimatedCountPaginator(self.addresses, 10)
+        # SQLite has no estimate
+        self.assertEqual(paginator.count, 3)
+
+    def test_resend_action(self):
+        old_keys = [address.key for address in self.addresses.all()]
+        self.run_action('resend_confirmation', self.addresses[:2])
+
+        new_keys = [address.key for address in self.addresses.all()]
+        self.assertNotEqual(new_keys[:2], old_keys[:2])
+        self.assertEqual(new_keys[2], old_keys[2])
+        bodies = dict(
+            (message.to[0], message.body) for message in django_mail.outbox
+        )
+        self.assertEqual(sorted(bodies), ['user0@t.t', 'user1@t.t'])
+        self.assertIn(new_keys[0], bodies['user0@t.t'])
+
+    def test_confirm_action(self):
+        received = []
+
+        def listener(sender, addresses, **kwargs):
+            received.extend(address.email for address in addresses)
+        emails_confirmed.connect(listener)
+        self.addCleanup(emails_confirmed.disconnect, listener)
+
+        self.run_action('confirm', self.addresses[:2])
+        self.assertEqual(
+            [address.is_confirmed for address in self.addresses],
+            [True, True, False],
+        )
+        self.assertEqual(sorted(received), ['user0@t.t', 'user1@t.t'])
+
+    def test_purge_expired_action(self):
+        self.users[0].add_unconfirmed_email('old@t.t')
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.update(set_at=timezone.now() - timedelta(days=2))
+
+        self.run_action('purge_expired', EmailAddress.objects.all())
+        # primary emails are kept
+        self.assertEqual(
+            sorted(EmailAddress.objects.values_list('email', flat=True)),
+            ['admin@t.t', 'user0@t.t', 'user1@t.t', 'user2@t.t'],
+        )
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_run_benchmarks(self):
+        results = benchmarks.run_benchmarks(
+            users=5, addresses=1, iterations=3, keys=100,
+        )
+
+        self.assertEqual(
+            sorted(results['operations']), sorted(benchmarks.OPERATIONS),
+        )
+        for name, result in results['operations'].items():
+            self.assertEqual(result['iterations'], 3)
+            self.assertGreater(result['ops_per_sec'], 0)
+        self.assertEqual(
+            results['operations']['is_confirmed']['queries_per_op'], 1,
+        )
+        self.assertEqual(results['environment']['database_vendor'], 'sqlite')
+        self.assertEqual(results['environment']['addresses_per_user'], 2)
+        self.assertGreater(results['keys']['single_keys_per_sec'], 0)
+        self.assertEqual(
+            results['key_collisions']['length'],
+            settings.SIMPLE_EMAIL_CONFIRMATION_KEY_LENGTH,
+        )
+
+        # nothing is left behind
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(get_email_address_model().objects.exists())
+
+    @override_settings(
+        SIMPLE_EMAIL_CONFIRMATION_CACHE='default',
+        SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE=(100, timedelta(hours=1)),
+    )
+    def test_no_side_effects(self):
+        cache.clear()
+        received = []
+
+        def listener(sender, **kwargs):
+            received.append(kwargs['user'].pk)
+        for signal in (
+            unconfirmed_email_created, email_confirmed, primary_email_changed,
+        ):
+            signal.connect(listener)
+            self.addCleanup(signal.disconnect, listener)
+
+        metrics.reset_counters()
+        with self.captureOnCommitCallbacks() as callbacks:
+            benchmarks.run_benchmarks(
+                users=3, addresses=1, iterations=3, keys=100,
+            )
+        self.assertEqual(received, [])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(cache._cache, {})
+        self.assertNotIn('cache.misses', metrics.get_counters())
+
+        # only the run was muted
+        user = get_user_model().objects.create_user('after')
+        user.add_unconfirmed_email('after@t.t')
+        self.assertEqual(received, [user.pk])
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command(
+            'benchmark_email_confirmation', users=2, keys=100, stdout=stdout,
+        )
+        results = json.loads(stdout.getvalue())
+        self.assertEqual(
+            results['operations']['confirm_email']['iterations'], 2,
+        )
+
+
+measurements = []
+
+
+@override_settings(SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION=[
+    measurements.append,
+    'simple_email_confirmation.instrumentation.log_measurement',
+])
+class InstrumentationTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'myname', email='a@t.t',
+        )
+        self.key = self.user.get_confirmation_key()
+        del measurements[:]
+
+    def get_measurements(self, operation):
+        return [
+            measurement for measurement in measurements
+            if measurement.operation == operation
+        ]
+
+    def test_measurements(self):
+        logger = 'simple_email_confirmation.instrumentation'
+        with self.assertLogs(logger, 'DEBUG'):
+            self.user.confirm_email(self.key)
+
+        [user_measurement] = self.get_measurements('user.confirm_email')
+        [manager_measurement] = self.get_measurements('manager.confirm')
+        self.assertEqual(user_measurement.outcome, 'confirmed')
+        self.assertEqual(user_measurement.queries, 1)
+        self.assertGreater(user_measurement.duration, 0)
+        self.assertEqual(manager_measurement.outcome, 'confirmed')
+
+        EmailAddress = get_email_address_model()
+        self.assertEqual(EmailAddress.objects.confirm_once(self.key)[1], False)
+        measurement = self.get_measurements('manager.confirm_once')[-1]
+        self.assertEqual(measurement.outcome, 'already_confirmed')
+
+    def test_confirm_outcomes(self):
+        EmailAddress = get_email_address_model()
+        EmailAddress.objects.confirm(self.key, save=False)
+        self.user.confirm_email(self.key)
+        self.user.confirm_email(self.key)
+        EmailAddress.objects.confirm(self.key, save=False)
+        self.assertEqual(
+            [m.outcome for m in self.get_measurements('manager.confirm')],
+            ['unsaved', 'confirmed', 'already_confirmed', 'already_confirmed'],
+        )
+        self.assertEqual(
+            [m.outcome for m in self.get_measurements('user.confirm_email')],
+            ['confirmed', 'already_confirmed'],
+        )
+
+    def test_failing_sink(self):
+        def sink(measurement):
+            raise ValueError
+
+        logger = 'simple_email_confirmation.instrumentation'
+        with override_settings(
+            SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION=[sink, measurements.append],
+        ):
+            with self.assertLogs(logger, 'ERROR'):
+                self.assertEqual(self.user.confirm_email(self.key), 'a@t.t')
+        self.assertTrue(self.user.is_confirmed)
+        self.assertEqual(len(self.get_measurements('user.confirm_email')), 1)
+
+    def test_failure_outcomes(self):
+        with self.assertRaises(EmailAddress.DoesNotExist):
+            self.user.confirm_email('wrong')
+        self.assertEqual(
+            self.get_measurements('user.confirm_email')[0].outcome, 'not_found',
+        )
+
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_PERIOD=timedelta(0)):
+            with self.assertRaises(EmailConfirmationExpired):
+                self.user.confirm_email(self.key)
+        self.assertEqual(
+            self.get_measurements('user.confirm_email')[1].outcome, 'expired',
+        )
+
+        with self.assertRaises(EmailNotConfirmed):
+            self.user.set_primary_email('other@t.t')
+        self.assertEqual(
+            self.get_measurements('user.set_primary_email')[0].outcome,
+            'not_confirmed',
+        )
+
+    def test_signal_sink(self):
+        received = []
+
+        def listener(sender, measurement, **kwargs):
+            received.append(measurement.operation)
+        operation_measured.connect(listener)
+        self.addCleanup(operation_measured.disconnect, listener)
+
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION=[
+            'simple_email_confirmation.instrumentation.send_measurement_signal',
+        ]):
+            self.user.add_unconfirmed_email('b@t.t')
+        self.assertEqual(
+            received,
+            ['manager.create_unconfirmed', 'user.add_unconfirmed_email'],
+        )
+
+    def test_disabled(self):
+        with override_settings(SIMPLE_EMAIL_CONFIRMATION_INSTRUMENTATION=None):
+            self.user.confirm_email(self.key)
+        self.assertEqual(measurements, [])
+
+    async def test_async(self):
+        await self.user.aconfirm_email(self.key)
+        [measurement] = self.get_measurements('user.aconfirm_email')
+        self.assertEqual(measurement.outcome, 'confirmed')
+        self.assertIsNone(measurement.queries)
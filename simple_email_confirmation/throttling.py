@@ -0,0 +1,156 @@
+"""
+Simple Email Confirmation resend throttling
+
+Both are off by default.
+
+With settings.SIMPLE_EMAIL_CONFIRMATION_RESEND_COOLDOWN set to a timedelta,
+resetting the confirmation of an address that's been unconfirmed for less
+than that returns its current key without a write. Each time, the
+'resend.suppressed' counter in simple_email_confirmation.metrics is increased.
+
+With settings.SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE set to a (count,
+timedelta) pair, resetting the confirmation of an address more than count
+times per period, for the same User or the same email, raises
+EmailConfirmationThrottled and increases the 'resend.throttled' counter.
+Counts are kept in one of your CACHES by default; for other storage, set
+settings.SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE_STORAGE to the dotted path of
+a RateLimitStorage subclass.
+"""
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import cache as status_cache, metrics
+from .exceptions import EmailConfirmationThrottled
+
+
+def get_resend_cooldown():
+    return getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_RESEND_COOLDOWN', None)
+
+
+def get_resend_rate():
+    return getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE', None)
+
+
+def in_cooldown(address):
+    "Was this unconfirmed address's key set within the resend cooldown?"
+    cooldown = get_resend_cooldown()
+    if cooldown is None or address.is_confirmed or address.is_key_expired:
+        return False
+    return timezone.now() < address.set_at + cooldown
+
+
+class RateLimitStorage(object):
+    "Interface for storing rate limit counts"
+
+    def hit(self, key, period):
+        """
+        Count a hit on key and return the number of hits on it in the
+        current period, a timedelta
+        """
+        raise NotImplementedError
+
+    async def ahit(self, key, period):
+        "Async version of hit()"
+        return await sync_to_async(self.hit)(key, period)
+
+
+class CacheRateLimitStorage(RateLimitStorage):
+    """
+    Fixed-window counts in the cache named by
+    settings.SIMPLE_EMAIL_CONFIRMATION_CACHE, or the default one
+    """
+
+    def get_cache(self):
+        alias = getattr(settings, 'SIMPLE_EMAIL_CONFIRMATION_CACHE', None)
+        return caches[alias or 'default']
+
+    def make_key(self, key):
+        prefix = getattr(
+            settings, 'SIMPLE_EMAIL_CONFIRMATION_CACHE_KEY_PREFIX',
+            'simple_email_confirmation',
+        )
+        return '{}:resend:{}'.format(prefix, key)
+
+    def hit(self, key, period):
+        cache = self.get_cache()
+        key = self.make_key(key)
+        # the window starts with its first hit
+        if cache.add(key, 1, period.total_seconds()):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # expired between add() and incr()
+            cache.add(key, 1, period.total_seconds())
+            return 1
+
+    async def ahit(self, key, period):
+        cache = self.get_cache()
+        key = self.make_key(key)
+        if await cache.aadd(key, 1, period.total_seconds()):
+            return 1
+        try:
+            return await cache.aincr(key)
+        except ValueError:
+            await cache.aadd(key, 1, period.total_seconds())
+            return 1
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    "The storage rate limit counts are kept in"
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            path = getattr(
+                settings, 'SIMPLE_EMAIL_CONFIRMATION_RESEND_RATE_STORAGE',
+                'simple_email_confirmation.throttling.CacheRateLimitStorage',
+            )
+            _storage = import_string(path)()
+        return _storage
+
+
+def _rate_limit_keys(address):
+    return [
+        'user:{}'.format(address.user_id),
+        'email:{}'.format(address.email.lower()),
+    ]
+
+
+def _check(counts, limit):
+    if any(count > limit for count in counts):
+        metrics.incr('resend.throttled')
+        raise EmailConfirmationThrottled()
+
+
+def check_rate(address):
+    "Count a resend of the address, raising if there have been too many"
+    rate = get_resend_rate()
+    if rate is None or status_cache.is_bypassed():
+        return
+    limit, period = rate
+    storage = get_storage()
+    _check(
+        [storage.hit(key, period) for key in _rate_limit_keys(address)], limit,
+    )
+
+
+async def acheck_rate(address):
+    "Async version of check_rate()"
+    rate = get_resend_rate()
+    if rate is None or status_cache.is_bypassed():
+        return
+    limit, period = rate
+    storage = get_storage()
+    _check(
+        [await storage.ahit(key, period) for key in _rate_limit_keys(address)],
+        limit,
+    )